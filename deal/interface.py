@@ -6,9 +6,13 @@ from django.db.models import Q,  Sum, Count
 from explorer_s_common import  raw_sql
 from explorer_s_common.utils import format_return, height_to_datetime
 from explorer_s_common.third.bbhe_sdk import BbheEsBase
+from explorer_s_data.utils import iter_height_messages
 
 from deal.models import Deal
 
+# 解析订单需要的消息字段
+DEAL_MESSAGE_FIELDS = ['height', 'msg_cid', 'msg_method_name', 'msg_params', 'msg_return']
+
 
 class DealBase(object):
 
@@ -111,7 +115,19 @@ class DealBase(object):
         if deal:
             start_height = deal.height
         deal_hits = BbheEsBase().get_messages_deal_list(start_height=start_height).get('hits', [])
+        return format_return(0, data=self.save_deal_messages(deal_hits))
+
+    def sync_deal_by_heights(self, start_height, end_height, batch_size=120):
+        """按高度区间流式扫描消息并解析订单，用于补数据"""
+        count = 0
+        for batch_start, batch_end, hits in iter_height_messages(start_height, end_height, batch_size=batch_size,
+                                                                 fields=DEAL_MESSAGE_FIELDS):
+            count += self.save_deal_messages(
+                [x for x in hits if x['_source'].get('msg_method_name') == 'PublishStorageDeals'])
+        return format_return(0, data=count)
 
+    def save_deal_messages(self, deal_hits):
+        """解析PublishStorageDeals消息并更新订单，返回新增订单数"""
         count = 0
         for per in deal_hits:
             s = per['_source']
@@ -136,8 +152,7 @@ class DealBase(object):
                 )
                 if created:
                     count += 1
-
-        return format_return(0, data=count)
+        return count
 
     def deal_all_list(self, height):
         """
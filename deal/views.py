@@ -1,8 +1,10 @@
 from explorer_s_common.decorator import common_ajax_response
 from explorer_s_common.utils import format_return, format_power
 from explorer_s_common.page import Page
+from explorer_s_data.utils import cursor_page
 from deal.interface import DealBase,Deal
 from deal.serializer import DealSerializer,DealModeSerializer
+from job.interface import JobBase
 
 
 @common_ajax_response
@@ -23,7 +25,19 @@ def sync_deal(request):
     '''
     增量同步订单
     '''
-    return DealBase().sync_deal_new()
+    return JobBase().enqueue('sync_deal')
+
+
+@common_ajax_response
+def sync_deal_by_heights(request):
+    '''
+    按高度区间[start_height, end_height)扫描消息补同步订单
+    '''
+    start_height = int(request.POST.get('start_height', 0))
+    end_height = int(request.POST.get('end_height', 0))
+    if start_height <= 0 or end_height <= start_height:
+        return format_return(99904, data={})
+    return JobBase().enqueue('sync_deal_by_heights', params={'start_height': start_height, 'end_height': end_height})
 
 
 @common_ajax_response
@@ -32,12 +46,20 @@ def deal_list(request):
     page_size = int(request.POST.get('page_size', 20))
     page_index = int(request.POST.get('page_index', 1))
     objs = DealBase().get_deal_list(key_words)
-    data = Page(objs, page_size).page(page_index)
+    # 传cursor时使用游标分页，第一页传空字符串
+    cursor = request.POST.get('cursor')
+    if cursor is not None:
+        data = cursor_page(objs, page_size, cursor=cursor, keys=('deal_id', 'id'))
+        if data is None:
+            return format_return(99904, data={})
+    else:
+        data = Page(objs, page_size).page(page_index)
     serializer = DealSerializer(data['objects'], many=True, fields=("deal_id", "client", "provider", "piece_size",
                                                                     "is_verified", "height", "record_time"))
-    return format_return(0, data={'objs': serializer.data,
-                                  'total_page': data['total_page'], 'total_count': data['total_count']
-    })
+    result = {'objs': serializer.data, 'total_page': data['total_page'], 'total_count': data['total_count']}
+    if cursor is not None:
+        result.update({'next_cursor': data['next_cursor'], 'has_next': data['has_next']})
+    return format_return(0, data=result)
 
 
 @common_ajax_response
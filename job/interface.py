@@ -0,0 +1,380 @@
+import os
+import json
+import socket
+import logging
+import datetime
+import threading
+import traceback
+
+from django.db import connection
+from django.db.models import F
+
+from explorer_s_common.utils import format_return
+
+from job.models import SyncJob, SyncJobTask
+
+
+def _yesterday():
+    return str((datetime.datetime.now() - datetime.timedelta(days=1)).date())
+
+
+def _sync_active_miners(params, checkpoint):
+    from miner.interface import MinerBase
+    from miner.models import Miner
+    # 上一次同步到的矿工数记在断点中，用于判断本次数据是否完整，force为True时直接删除没有同步到的矿工
+    result = MinerBase().sync_active_miners(last_seen_count=checkpoint.get('seen_count'),
+                                            force=params.get('force', False))
+    # 新矿工没有加入时间时不会出现在矿工列表中，提交回填任务(失败的矿工由任务内部退避)
+    if Miner.objects.filter(join_time__isnull=True).exists():
+        JobBase().enqueue('sync_miner_join_time')
+    MinerBase().sync_miner_temp_stat()
+    return result, {'seen_count': result['data']['seen_count']}
+
+
+def _sync_miner_join_time(params, checkpoint):
+    from miner.interface import MinerBase
+    return MinerBase().sync_miner_join_time(), None
+
+
+def _rebuild_miner_address(params, checkpoint):
+    from miner.interface import MinerBase
+    return MinerBase().rebuild_miner_address(), None
+
+
+def _sync_miner_total_stat(params, checkpoint):
+    from miner.interface import MinerBase
+    return MinerBase().sync_miner_total_stat(full=params.get('full', False)), None
+
+
+def _sync_miner_history(params, checkpoint):
+    from miner.interface import MinerBase
+    result = MinerBase().sync_miner_history(date=params.get('date'))
+    _enqueue_miner_day_columns(params.get('date'))
+    # 快照完成后重新计算排行榜
+    JobBase().enqueue('sync_miner_leaderboard', params={'date': params['date']} if params.get('date') else None)
+    return result, None
+
+
+def _enqueue_miner_day_columns(date):
+    '''按天同步完成后增量更新列式缓存，没有日期时全量重建'''
+    JobBase().enqueue('sync_miner_day_columns', params={'date': date} if date else None)
+
+
+def _sync_miner_day_columns(params, checkpoint):
+    from miner.interface import MinerBase
+    return MinerBase().sync_miner_day_columns(date=params.get('date')), None
+
+
+def _check_miner_day_cum(params, checkpoint):
+    from miner.interface import MinerBase, MINER_DAY_CUM_COLUMNS
+    miner_nos = params.get('miner_nos')
+    repair = params.get('repair', False)
+    result = MinerBase().check_miner_day_cum(miner_nos=miner_nos.split(',') if miner_nos else None, repair=repair)
+    if repair and result['data']['mismatch_count']:
+        # 修复改写了update_time，列式缓存从最早变化的日期开始重建
+        _enqueue_miner_day_columns(_yesterday())
+    if miner_nos:
+        return result, None
+    # 全量检查通过或已修复时记录当时的累计列，查询据此判断累计列是否可用
+    if repair or not result['data']['mismatch_count']:
+        return result, {'cum_columns': MINER_DAY_CUM_COLUMNS, 'check_time': str(datetime.datetime.now())[:19]}
+    return result, {}
+
+
+def _sync_miner_leaderboard(params, checkpoint):
+    from miner.interface import MinerBase
+    return MinerBase().sync_miner_leaderboard(end_date=params.get('date')), None
+
+
+def _sync_miner_day_gas(params, checkpoint):
+    from miner.interface import MinerBase
+    # 高度断点由MinerSyncLog记录
+    if params.get('sharded'):
+        # 默认只重跑未完成的分片，reset为True时清空当天汽油费重新同步
+        result = MinerBase().sync_miner_day_gas_sharded(
+            date=params.get('date'), shard_count=int(params.get('shard_count') or 12),
+            reset=params.get('reset', False))
+    else:
+        result = MinerBase().sync_miner_day_gas(date=params.get('date'))
+    _enqueue_miner_day_columns(params.get('date'))
+    return result, None
+
+
+def _sync_miner_day_overtime_pledge_fee(params, checkpoint):
+    from miner.interface import MinerBase
+    date = params.get('date') or _yesterday()
+    result = MinerBase().sync_miner_day_overtime_pledge_fee(date=date)
+    _enqueue_miner_day_columns(date)
+    return result, None
+
+
+def _sync_miner_lotus(params, checkpoint):
+    from miner.interface import MinerBase
+    return MinerBase().sync_miner_lotus(), None
+
+
+def _sync_tipset_gas(params, checkpoint, max_lag=2880):
+    '''
+    同步区块gas汇总
+    没有指定开始高度时从上次同步到的高度继续，落后超过max_lag个高度时只同步最近121个高度
+    '''
+    from message.interface import MessageBase
+    from message.models import TipsetGasSum
+    from miner.interface import MinerBase
+
+    end_index = params.get('end_index')
+    if not end_index:
+        end_index = int((datetime.datetime.now() - MessageBase().launch_date).total_seconds() / 30)
+    end_index = int(end_index)
+
+    start_index = params.get('start_index') or checkpoint.get('end_index')
+    if not start_index or end_index - int(start_index) > max_lag:
+        start_index = end_index - 121
+    start_index = min(int(start_index), end_index - 1)
+
+    pool_miners_dict = dict([(x.miner_no, True) for x in MinerBase().get_miner_list(is_pool=True)])
+    # 补汽油费为0的数据
+    for per in TipsetGasSum.objects.filter(pre_gas=0, prove_gas=0, win_post_gas=0)[:50]:
+        MessageBase().sync_tipset_gas(height=per.height, pool_miners_dict=pool_miners_dict)
+    # 同步新的数据
+    MessageBase().sync_tipset_gas_range(start_height=start_index, end_height=end_index,
+                                        pool_miners_dict=pool_miners_dict)
+    # 消息延迟预警
+    MessageBase().sync_tipset_gas_warning()
+    return format_return(0), {'end_index': max(end_index, int(checkpoint.get('end_index') or 0))}
+
+
+def _sync_overtime_pledge(params, checkpoint):
+    from message.interface import MessageBase
+    return MessageBase().sync_overtime_pledge(), None
+
+
+def _sync_tipset(params, checkpoint):
+    from tipset.interface import TipsetBase
+    return TipsetBase().sync_tipset(date=params.get('date')), None
+
+
+def _sync_temp_tipset(params, checkpoint):
+    from tipset.interface import TipsetBase
+    TipsetBase().sync_temp_tipset()
+    return TipsetBase().sync_tipset_warning(), None
+
+
+def _rebuild_temp_tipset_hour_stat(params, checkpoint):
+    from tipset.interface import TipsetBase
+    return TipsetBase().rebuild_temp_tipset_hour_stat(), None
+
+
+def _sync_deal(params, checkpoint):
+    from deal.interface import DealBase
+    # 订单按已同步的最大高度增量同步
+    return DealBase().sync_deal_new(), None
+
+
+def _sync_deal_by_heights(params, checkpoint):
+    from deal.interface import DealBase
+    # 按高度区间补数据
+    return DealBase().sync_deal_by_heights(start_height=int(params['start_height']),
+                                           end_height=int(params['end_height'])), None
+
+
+# 执行结果的code不为0时任务按失败记录，并重新排队，最多重试的次数
+MAX_TASK_RETRIES = 3
+
+# 任务注册表: 任务名称 -> (执行函数, 最大并发数, 锁超时时间)
+# 执行函数参数为(params, checkpoint)，返回(执行结果, 新的断点)，断点为None时保持不变
+SYNC_JOBS = {
+    'sync_active_miners': (_sync_active_miners, 1, 1800),
+    'sync_miner_join_time': (_sync_miner_join_time, 1, 3600),
+    'sync_miner_total_stat': (_sync_miner_total_stat, 1, 3600),
+    'rebuild_miner_address': (_rebuild_miner_address, 1, 3600),
+    'sync_miner_history': (_sync_miner_history, 1, 3600),
+    'sync_miner_leaderboard': (_sync_miner_leaderboard, 1, 3600),
+    'sync_miner_day_columns': (_sync_miner_day_columns, 1, 3600),
+    'check_miner_day_cum': (_check_miner_day_cum, 1, 3 * 3600),
+    'sync_miner_day_gas': (_sync_miner_day_gas, 1, 3 * 3600),
+    'sync_miner_day_overtime_pledge_fee': (_sync_miner_day_overtime_pledge_fee, 1, 3600),
+    'sync_miner_lotus': (_sync_miner_lotus, 1, 1800),
+    'sync_tipset_gas': (_sync_tipset_gas, 1, 1800),
+    'sync_overtime_pledge': (_sync_overtime_pledge, 1, 1800),
+    'sync_tipset': (_sync_tipset, 1, 3600),
+    'sync_temp_tipset': (_sync_temp_tipset, 1, 1800),
+    'rebuild_temp_tipset_hour_stat': (_rebuild_temp_tipset_hour_stat, 1, 1800),
+    'sync_deal': (_sync_deal, 1, 3600),
+    'sync_deal_by_heights': (_sync_deal_by_heights, 1, 3600),
+}
+
+
+class JobBase(object):
+
+    def __init__(self):
+        self.worker = '%s:%s' % (socket.gethostname(), os.getpid())
+
+    def get_job(self, job_name):
+        '''获取任务状态行，不存在时按注册表创建'''
+        handler, max_concurrency, lock_timeout = SYNC_JOBS[job_name]
+        job, created = SyncJob.objects.get_or_create(
+            name=job_name, defaults={'max_concurrency': max_concurrency, 'lock_timeout': lock_timeout})
+        return job
+
+    def enqueue(self, job_name, params=None):
+        '''
+        提交同步任务
+        同名同参数的任务还在排队时直接返回排队中的任务
+        '''
+        if job_name not in SYNC_JOBS:
+            return format_return(99904, data={})
+        self.get_job(job_name)
+        params = json.dumps(params or {}, sort_keys=True)
+        task = SyncJobTask.objects.filter(job_name=job_name, params=params, status=0).order_by('id').first()
+        if not task:
+            task = SyncJobTask.objects.create(job_name=job_name, params=params)
+        return format_return(0, data={'task_id': task.id, 'job_name': job_name})
+
+    def get_checkpoint(self, job_name):
+        return json.loads(self.get_job(job_name).checkpoint or '{}')
+
+    def save_checkpoint(self, job_name, checkpoint):
+        SyncJob.objects.filter(name=job_name).update(
+            checkpoint=json.dumps(checkpoint, sort_keys=True), update_time=datetime.datetime.now())
+
+    def _acquire(self, job):
+        '''条件更新占用一个并发名额，成功返回True'''
+        now = datetime.datetime.now()
+        return SyncJob.objects.filter(id=job.id, running_count__lt=F('max_concurrency')).update(
+            running_count=F('running_count') + 1, last_start_time=now, update_time=now) == 1
+
+    def _release(self, job, status=None, error=None):
+        '''释放并发名额，status不为空时同时记录最近一次执行结果'''
+        now = datetime.datetime.now()
+        SyncJob.objects.filter(id=job.id, running_count__gt=0).update(
+            running_count=F('running_count') - 1, update_time=now)
+        if status is not None:
+            SyncJob.objects.filter(id=job.id).update(last_finish_time=now, last_status=status, last_error=error)
+
+    def recover_timeout_tasks(self):
+        '''
+        执行进程异常退出后，超过锁超时时间没有心跳的任务标记为失败并释放并发名额
+        执行中的任务由心跳线程定期刷新update_time，运行时间再长也不会被回收
+        '''
+        now = datetime.datetime.now()
+        count = 0
+        for job in SyncJob.objects.filter(running_count__gt=0):
+            timeout_time = now - datetime.timedelta(seconds=job.lock_timeout)
+            for task in SyncJobTask.objects.filter(job_name=job.name, status=1, update_time__lt=timeout_time):
+                if SyncJobTask.objects.filter(id=task.id, status=1, update_time__lt=timeout_time).update(
+                        status=3, result='锁超时', finish_time=now, update_time=now) == 1:
+                    self._release(job, 3, error='任务%s锁超时' % task.id)
+                    count += 1
+        if count:
+            logging.warning('回收超时任务 %s 个' % count)
+        return count
+
+    def _start_heartbeat(self, task_id, lock_timeout):
+        '''
+        后台线程定期刷新执行中任务的update_time，间隔为锁超时时间的1/3(最长60秒)
+        返回Event，set后线程退出
+        '''
+        stop = threading.Event()
+        interval = max(min(lock_timeout / 3.0, 60), 1)
+
+        def _beat():
+            try:
+                while not stop.wait(interval):
+                    SyncJobTask.objects.filter(id=task_id, status=1).update(update_time=datetime.datetime.now())
+            finally:
+                # 线程中的数据库连接不会被请求周期回收
+                connection.close()
+
+        threading.Thread(target=_beat, daemon=True).start()
+        return stop
+
+    def run_task(self, task):
+        '''
+        执行一个排队中的任务
+        并发名额已满或任务已被其他进程领取时返回False
+        '''
+        job = self.get_job(task.job_name)
+        if not self._acquire(job):
+            return False
+        now = datetime.datetime.now()
+        if SyncJobTask.objects.filter(id=task.id, status=0).update(
+                status=1, worker=self.worker, start_time=now, update_time=now) != 1:
+            self._release(job)
+            return False
+
+        handler = SYNC_JOBS[task.job_name][0]
+        # 只有执行函数正常返回才算成功，KeyboardInterrupt、SystemExit等按失败记录
+        status, error, result = 3, '任务被中断', None
+        heartbeat = self._start_heartbeat(task.id, job.lock_timeout)
+        try:
+            result, checkpoint = handler(json.loads(task.params or '{}'), json.loads(job.checkpoint or '{}'))
+            if checkpoint is not None:
+                self.save_checkpoint(task.job_name, checkpoint)
+            if isinstance(result, dict) and result.get('code'):
+                status, error = 3, json.dumps(result, default=str)
+                self._retry(task)
+            else:
+                status, error = 2, None
+        except Exception:
+            status, error = 3, traceback.format_exc()
+            logging.warning('任务%s(%s)执行失败: %s' % (task.id, task.job_name, error))
+        finally:
+            heartbeat.set()
+            now = datetime.datetime.now()
+            SyncJobTask.objects.filter(id=task.id).update(
+                status=status, result=error or json.dumps(result, default=str), finish_time=now, update_time=now)
+            self._release(job, status, error=error)
+        return True
+
+    def _retry(self, task):
+        '''执行结果失败的任务按原参数重新排队，超过MAX_TASK_RETRIES次后不再重试'''
+        if task.retry_count >= MAX_TASK_RETRIES:
+            logging.warning('任务%s(%s)重试%s次后仍失败' % (task.id, task.job_name, task.retry_count))
+            return None
+        if SyncJobTask.objects.filter(job_name=task.job_name, params=task.params, status=0).exists():
+            return None
+        return SyncJobTask.objects.create(job_name=task.job_name, params=task.params,
+                                          retry_count=task.retry_count + 1)
+
+    def run_pending_tasks(self, job_names=None, limit=None):
+        '''按提交顺序执行排队中的任务，返回执行的任务数'''
+        self.recover_timeout_tasks()
+        tasks = SyncJobTask.objects.filter(status=0)
+        if job_names:
+            tasks = tasks.filter(job_name__in=job_names)
+        count = 0
+        for task in tasks.order_by('id')[:limit or 100]:
+            if self.run_task(task):
+                count += 1
+        return count
+
+    def get_job_status(self, job_name=None):
+        '''任务状态及排队数量'''
+        jobs = SyncJob.objects.filter()
+        if job_name:
+            jobs = jobs.filter(name=job_name)
+        pending_dict = {}
+        for name in SyncJobTask.objects.filter(status=0).values_list('job_name', flat=True):
+            pending_dict[name] = pending_dict.get(name, 0) + 1
+        data = []
+        for job in jobs:
+            data.append({
+                'name': job.name, 'max_concurrency': job.max_concurrency, 'running_count': job.running_count,
+                'pending_count': pending_dict.get(job.name, 0), 'checkpoint': json.loads(job.checkpoint or '{}'),
+                'last_start_time': job.last_start_time.strftime('%Y-%m-%d %H:%M:%S') if job.last_start_time else None,
+                'last_finish_time': job.last_finish_time.strftime('%Y-%m-%d %H:%M:%S') if job.last_finish_time else None,
+                'last_status': job.last_status, 'last_error': job.last_error
+            })
+        return format_return(0, data=data)
+
+    def get_task_status(self, task_id):
+        task = SyncJobTask.objects.filter(id=task_id).first()
+        if not task:
+            return format_return(99904, data={})
+        return format_return(0, data={
+            'task_id': task.id, 'job_name': task.job_name, 'params': json.loads(task.params or '{}'),
+            'status': task.status, 'worker': task.worker, 'result': task.result,
+            'start_time': task.start_time.strftime('%Y-%m-%d %H:%M:%S') if task.start_time else None,
+            'finish_time': task.finish_time.strftime('%Y-%m-%d %H:%M:%S') if task.finish_time else None,
+        })
@@ -0,0 +1,76 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from explorer_s_data.bench import record_sdk, replay_sdk, bench_call
+
+BENCH_STEPS = ['sync_active_miners', 'sync_miner_history', 'sync_miner_day_gas', 'sync_tipset_gas', 'sync_tipset']
+
+
+class Command(BaseCommand):
+    help = '''
+    同步流程基准测试，统计耗时、查询数与每秒写入行数
+    --record时访问真实接口并录制响应，否则从fixture回放
+    会写入当前配置的数据库，只在本地库上运行
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', required=True, help='fixture目录')
+        parser.add_argument('--record', action='store_true', help='访问真实接口并录制响应')
+        parser.add_argument('--steps', default=','.join(BENCH_STEPS), help='执行的步骤，逗号分隔')
+        parser.add_argument('--date', default='', help='按天同步的日期，默认昨天')
+        parser.add_argument('--start-height', type=int, default=0, help='sync_tipset_gas开始高度，默认date当天最后121个高度')
+        parser.add_argument('--end-height', type=int, default=0, help='sync_tipset_gas结束高度')
+        parser.add_argument('--latency', type=float, default=0, help='回放时每次调用模拟的网络延迟(秒)')
+
+    def get_steps(self, options):
+        from miner.interface import MinerBase
+        from message.interface import MessageBase
+        from tipset.interface import TipsetBase
+
+        date = options['date'] or str((datetime.datetime.now() - datetime.timedelta(days=1)).date())
+        end_height = options['end_height']
+        if not end_height:
+            end_date = datetime.datetime.strptime(date, '%Y-%m-%d') + datetime.timedelta(days=1)
+            end_height = int((end_date - MessageBase().launch_date).total_seconds() / 30)
+        start_height = options['start_height'] or end_height - 121
+
+        def _sync_tipset_gas():
+            pool_miners_dict = dict([(x.miner_no, True) for x in MinerBase().get_miner_list(is_pool=True)])
+            MessageBase().sync_tipset_gas_range(start_height=start_height, end_height=end_height,
+                                                pool_miners_dict=pool_miners_dict)
+
+        return {
+            'sync_active_miners': lambda: MinerBase().sync_active_miners(),
+            'sync_miner_history': lambda: MinerBase().sync_miner_history(date=date),
+            'sync_miner_day_gas': lambda: MinerBase().sync_miner_day_gas(date=date),
+            'sync_tipset_gas': _sync_tipset_gas,
+            'sync_tipset': lambda: TipsetBase().sync_tipset(date=date),
+        }
+
+    def handle(self, *args, **options):
+        step_names = [x for x in options['steps'].split(',') if x]
+        for step_name in step_names:
+            if step_name not in BENCH_STEPS:
+                raise ValueError('未知的步骤: %s' % step_name)
+        steps = self.get_steps(options)
+
+        if options['record']:
+            context = record_sdk(options['fixtures'])
+        else:
+            context = replay_sdk(options['fixtures'], latency=options['latency'])
+
+        results = []
+        with context:
+            for step_name in step_names:
+                result = bench_call(steps[step_name])
+                results.append((step_name, result))
+                self.stdout.write('%s: %.2f s, %s 次查询, 写入 %s 行, %s 行/s' % (
+                    step_name, result['time_cost'], result['query_count'], result['write_rows'],
+                    result['rows_per_second']))
+
+        total_time = sum([x[1]['time_cost'] for x in results])
+        total_rows = sum([x[1]['write_rows'] for x in results])
+        self.stdout.write('合计: %.2f s, %s 次查询, 写入 %s 行, %s 行/s' % (
+            total_time, sum([x[1]['query_count'] for x in results]), total_rows,
+            int(total_rows / total_time) if total_time else total_rows))
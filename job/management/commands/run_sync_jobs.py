@@ -0,0 +1,35 @@
+import time
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from job.interface import JobBase, SYNC_JOBS
+
+
+class Command(BaseCommand):
+    help = '执行排队中的同步任务，可以按任务名称启动多个进程分开执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', default='', help='只执行这些任务，逗号分隔，默认全部')
+        parser.add_argument('--interval', type=int, default=5, help='没有任务时的轮询间隔(秒)')
+        parser.add_argument('--once', action='store_true', help='执行一轮后退出')
+
+    def handle(self, *args, **options):
+        job_names = [x for x in options['jobs'].split(',') if x]
+        for job_name in job_names:
+            if job_name not in SYNC_JOBS:
+                raise ValueError('未知的任务: %s' % job_name)
+
+        job_base = JobBase()
+        while True:
+            close_old_connections()
+            try:
+                count = job_base.run_pending_tasks(job_names=job_names)
+            except Exception as e:
+                logging.warning('执行同步任务出错: %s' % e)
+                count = 0
+            if options['once']:
+                break
+            if not count:
+                time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+from django.db import models
+
+
+class SyncJob(models.Model):
+    '''同步任务状态表，每种任务一行，兼作并发锁与断点'''
+    name = models.CharField('任务名称', max_length=64, unique=True)
+    max_concurrency = models.IntegerField('最大并发数', default=1)
+    running_count = models.IntegerField('运行中的数量', default=0)
+    lock_timeout = models.IntegerField('锁超时时间(秒)', default=3600)
+    checkpoint = models.TextField('断点(json)', default='{}')
+    last_start_time = models.DateTimeField('最近开始时间', null=True)
+    last_finish_time = models.DateTimeField('最近结束时间', null=True)
+    last_status = models.IntegerField('最近状态', default=0)
+    last_error = models.TextField('最近错误', null=True)
+    create_time = models.DateTimeField('创建时间', auto_now_add=True)
+    update_time = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        ordering = ["name", ]
+
+
+class SyncJobTask(models.Model):
+    '''同步任务队列'''
+    status_choices = ((0, '等待'), (1, '运行中'), (2, '成功'), (3, '失败'),)
+    id = models.BigAutoField(primary_key=True)
+    job_name = models.CharField('任务名称', max_length=64, db_index=True)
+    params = models.TextField('参数(json)', default='{}')
+    status = models.IntegerField(verbose_name='状态', choices=status_choices, default=0, db_index=True)
+    worker = models.CharField('执行进程', max_length=128, null=True)
+    result = models.TextField('执行结果', null=True)
+    retry_count = models.IntegerField('重试次数', default=0)
+    start_time = models.DateTimeField('开始时间', null=True)
+    finish_time = models.DateTimeField('结束时间', null=True)
+    create_time = models.DateTimeField('创建时间', auto_now_add=True)
+    update_time = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        ordering = ["-create_time", ]
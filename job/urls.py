@@ -0,0 +1,7 @@
+from django.conf.urls import url
+
+from job import views
+
+urlpatterns = [
+    url(r'^get_sync_job_status$', views.get_sync_job_status),
+]
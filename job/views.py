@@ -0,0 +1,16 @@
+from explorer_s_common.decorator import common_ajax_response
+
+from job.interface import JobBase
+
+
+@common_ajax_response
+def get_sync_job_status(request):
+    '''
+    同步任务状态
+    传task_id时返回单个任务的执行情况
+    '''
+    task_id = request.POST.get('task_id')
+    if task_id:
+        return JobBase().get_task_status(task_id=int(task_id))
+    job_name = request.POST.get('job_name')
+    return JobBase().get_job_status(job_name=job_name)
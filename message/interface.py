@@ -20,6 +20,7 @@ from explorer_s_common.third.filscan_sdk import FilscanBase
 from explorer_s_common.third.bbhe_sdk import BbheBase, BbheEsBase
 
 from explorer_s_data.consts import ERROR_DICT
+from explorer_s_data.utils import iter_height_messages
 from message.models import TipsetGasSum, TipsetGasStat, PoolTipsetGasStat, PledgeHistory, OvertimePledge
 from miner.interface import MinerBase
 
@@ -359,6 +360,19 @@ class MessageBase(object):
         # 现在改版了算法不对了 2021-08-01
         # self.sync_pledge_history(height=height, messages=messages)
 
+    def sync_tipset_gas_range(self, start_height, end_height, pool_miners_dict={}, batch_size=120, prefetch=2):
+        '''流式同步高度区间[start_height, end_height)的汽油费'''
+        for batch_start, batch_end, hits in iter_height_messages(start_height, end_height, batch_size=batch_size,
+                                                                 prefetch=prefetch):
+            height_messages = {}
+            for per in hits:
+                height_messages.setdefault(per['_source']['height'], []).append(per)
+            for height in sorted(height_messages.keys()):
+                messages = height_messages[height]
+                self.sync_tipset_gas_sum(height=height, messages=messages)
+                self.sync_tipset_gas_stat(height=height, messages=messages)
+                self.sync_pool_tipset_gas_stat(height=height, messages=messages, pool_miners_dict=pool_miners_dict)
+
     def sync_tipset_gas_sum(self, height, messages):
         '''同步单个区块gas汇总'''
         pre_gas_32 = _d(0)
@@ -12,8 +12,8 @@ from explorer_s_common.decorator import common_ajax_response
 from explorer_s_common.utils import format_return, format_price, format_power, str_2_power, format_fil, _d,get_aggregate_gas
 from explorer_s_common.page import Page
 from message.interface import MessageBase
-from miner.interface import MinerBase
 from tipset.interface import TipsetBase
+from job.interface import JobBase
 
 
 @common_ajax_response
@@ -228,29 +228,16 @@ def get_message_detail(request):
 def sync_tipset_gas(request):
     '''
     同步单个区块gas汇总
+    同步范围默认从上次同步到的高度开始
     '''
-    launch_date = datetime.datetime(2020, 8, 25, 6, 0, 0)
     end_index = request.POST.get('end_index')
-    if not end_index:
-        end_index = int((datetime.datetime.now() - launch_date).total_seconds() / 30)
-    end_index = int(end_index)
-
     start_index = request.POST.get('start_index')
-    if not start_index:
-        start_index = end_index - 121
-    start_index = int(start_index)
-
-    pool_miners_dict = dict([(x.miner_no, True) for x in MinerBase().get_miner_list(is_pool=True)])
-    # 补汽油费为0的数据
-    from message.models import TipsetGasSum
-    for per in TipsetGasSum.objects.filter(pre_gas=0, prove_gas=0, win_post_gas=0)[:50]:
-        MessageBase().sync_tipset_gas(height=per.height, pool_miners_dict=pool_miners_dict)
-    # 同步新的数据
-    for i in range(start_index, end_index):
-        MessageBase().sync_tipset_gas(height=i, pool_miners_dict=pool_miners_dict)
-    # 消息延迟预警
-    MessageBase().sync_tipset_gas_warning()
-    return format_return(0)
+    params = {}
+    if end_index:
+        params['end_index'] = int(end_index)
+    if start_index:
+        params['start_index'] = int(start_index)
+    return JobBase().enqueue('sync_tipset_gas', params=params)
 
 
 @common_ajax_response
@@ -258,5 +245,4 @@ def sync_overtime_pledge(request):
     '''
     同步过期质押
     '''
-    MessageBase().sync_overtime_pledge()
-    return format_return(0)
+    return JobBase().enqueue('sync_overtime_pledge')
@@ -0,0 +1,338 @@
+'''
+矿工历史数据列式缓存
+每个数值字段一个定长数组，按(矿工槽位, 日期偏移)存储，由每晚的历史任务重建
+gunicorn各worker只读内存映射同一批文件，共享操作系统页缓存
+重建时记录MinerDay的update_time水位，之后有记录变化时缓存失效，直到下次重建
+'''
+import os
+import json
+import time
+import shutil
+import decimal
+import datetime
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max, Min
+
+from miner.models import MinerDay
+
+# 缓存的字段
+MINER_DAY_COLUMN_FIELDS = [
+    'power', 'sector_size', 'increase_power', 'increase_power_offset', 'block_reward', 'block_count', 'win_count',
+    'lucky', 'avg_reward', 'pre_gas', 'pre_gas_count', 'prove_gas', 'prove_gas_count', 'win_post_gas',
+    'win_post_gas_count', 'pledge_gas', 'overtime_pledge_fee', 'initial_pledge_balance', 'worker_balance',
+    'poster_balance'
+]
+
+# 小数字段按最小单位存成整数，拆成高低两个int64，保证求和不溢出且结果精确
+_SPLIT = 10 ** 9
+# 元数据与数据文件可见的检查间隔(秒)
+_RELOAD_INTERVAL = 60
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def get_column_dir():
+    return getattr(settings, 'MINER_DAY_COLUMN_DIR', os.path.join(settings.BASE_DIR, 'data', 'miner_day_columns'))
+
+
+def _decimal_places(field):
+    '''小数字段返回小数位数，整数字段返回None'''
+    return getattr(MinerDay._meta.get_field(field), 'decimal_places', None)
+
+
+def _split_decimal(value, places):
+    '''小数按最小单位转成整数后拆成(高位, 低位)，0和None都按0处理'''
+    return divmod(int(decimal.Decimal(value or 0).scaleb(places)), _SPLIT)
+
+
+def _to_date(value):
+    '''字符串、datetime统一转成date，与DateField查询时的转换一致'''
+    if not value:
+        return None
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def _load_base_store(column_dir, update_from):
+    '''
+    可以增量更新的已有缓存，必须覆盖全部历史且update_from不晚于缓存结束日期的下一天
+    返回(缓存, 实际开始读取的日期)，缓存之后有update_from之前的记录变化时从最早变化的日期开始读取
+    '''
+    try:
+        store = MinerDayColumnStore(column_dir)
+    except (IOError, OSError, ValueError, KeyError):
+        return None, update_from
+    if not store.full_history or store.update_time is None or update_from < store.start_date or \
+            update_from > store.end_date + datetime.timedelta(days=1):
+        return None, update_from
+    changed_date = MinerDay.objects.filter(update_time__gt=store.update_time, date__lt=update_from).aggregate(
+        Min('date'))['date__min']
+    if changed_date and changed_date < store.start_date:
+        return None, update_from
+    return store, min(changed_date or update_from, update_from)
+
+
+def _get_max_update_time():
+    return MinerDay.objects.aggregate(Max('update_time'))['update_time__max']
+
+
+def build_miner_day_columns(start_date=None, end_date=None, column_dir=None, chunk_days=10, update_from=None):
+    '''
+    重建列式缓存，默认覆盖全部历史
+    update_from: 已有缓存可用时只从数据库读取update_from之后的记录，之前的列直接从旧缓存复制
+    先写入临时目录，完成后整体替换，读取方下次检查时加载新版本
+    '''
+    _time_start = time.time()
+    column_dir = column_dir or get_column_dir()
+    # 先取水位再读数据，读取过程中变化的记录会让新缓存失效，不会被漏掉
+    update_time = _get_max_update_time()
+    start_date, end_date, update_from = _to_date(start_date), _to_date(end_date), _to_date(update_from)
+    base = None
+    if update_from and not start_date:
+        base, update_from = _load_base_store(column_dir, update_from)
+    full_history = not start_date
+    if base is not None:
+        start_date = base.start_date
+    if not start_date:
+        start_date = MinerDay.objects.order_by('date').values_list('date', flat=True).first()
+    if not end_date:
+        end_date = MinerDay.objects.aggregate(Max('date'))['date__max']
+    if not start_date or not end_date:
+        return 0
+    read_start = update_from if base is not None else start_date
+    days = (end_date - start_date).days + 1
+    new_nos = MinerDay.objects.filter(date__range=(read_start, end_date)).values_list(
+        'miner_no', flat=True).distinct().order_by()
+    if base is not None:
+        # 已有矿工保持原来的行号，新矿工追加在后面
+        miner_nos = base.miner_nos + sorted(set(new_nos) - set(base.miner_nos))
+    else:
+        miner_nos = sorted(new_nos)
+    miner_index = dict([(miner_no, i) for i, miner_no in enumerate(miner_nos)])
+    shape = (max(len(miner_nos), 1), days)
+
+    tmp_dir = column_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    def _open(name):
+        return np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'), mode='w+', dtype=np.int64, shape=shape)
+
+    exists = np.lib.format.open_memmap(os.path.join(tmp_dir, 'exists.npy'), mode='w+', dtype=np.uint8, shape=shape)
+    places_dict = dict([(field, _decimal_places(field)) for field in MINER_DAY_COLUMN_FIELDS])
+    arrays = {}
+    for field, places in places_dict.items():
+        arrays[field] = (_open(field + '.hi'), _open(field + '.lo')) if places is not None else (_open(field), None)
+
+    if base is not None:
+        # update_from之前的日期没有变化，按行列偏移复制
+        rows, copy_days = len(base.miner_nos), min((read_start - start_date).days, days)
+        if rows and copy_days:
+            exists[:rows, :copy_days] = base.exists[:rows, :copy_days]
+            for field, (hi, lo) in arrays.items():
+                base_hi, base_lo = base.arrays[field]
+                hi[:rows, :copy_days] = base_hi[:rows, :copy_days]
+                if lo is not None:
+                    lo[:rows, :copy_days] = base_lo[:rows, :copy_days]
+
+    count = 0
+    chunk_start = read_start
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), end_date)
+        # 同一天有重复记录时以最后创建的为准，与按-create_time排序取第一条一致
+        records = MinerDay.objects.filter(date__range=(chunk_start, chunk_end)).order_by('create_time').values_list(
+            'miner_no', 'date', *MINER_DAY_COLUMN_FIELDS)
+        rows, cols, values = [], [], [[] for x in MINER_DAY_COLUMN_FIELDS]
+        for record in records:
+            rows.append(miner_index[record[0]])
+            cols.append((record[1] - start_date).days)
+            for i, value in enumerate(record[2:]):
+                values[i].append(value)
+        if rows:
+            exists[rows, cols] = 1
+            for i, field in enumerate(MINER_DAY_COLUMN_FIELDS):
+                places = places_dict[field]
+                if places is None:
+                    arrays[field][0][rows, cols] = [int(x or 0) for x in values[i]]
+                    continue
+                hi_lo = [_split_decimal(x, places) for x in values[i]]
+                arrays[field][0][rows, cols] = [x[0] for x in hi_lo]
+                arrays[field][1][rows, cols] = [x[1] for x in hi_lo]
+            count += len(rows)
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+
+    exists.flush()
+    for hi, lo in arrays.values():
+        hi.flush()
+        if lo is not None:
+            lo.flush()
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': time.time(), 'start_date': str(start_date), 'end_date': str(end_date),
+            'update_time': update_time.strftime(_TIME_FORMAT) if update_time else None,
+            'full_history': full_history, 'miner_nos': miner_nos, 'decimal_places': places_dict
+        }, f)
+
+    # 整体替换，已经映射旧文件的进程不受影响
+    old_dir = column_dir + '.old'
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(column_dir):
+        os.rename(column_dir, old_dir)
+    os.rename(tmp_dir, column_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    logging.warning('重建矿工历史列式缓存耗时: %s s, %s 个矿工, %s 天, 从 %s 开始读取 %s 条记录' % (
+        time.time() - _time_start, len(miner_nos), days, read_start, count))
+    return count
+
+
+class MinerDayRow(object):
+    '''列式缓存中的一天记录，字段与MinerDay同名'''
+
+    def __init__(self, miner_no, date, values):
+        self.miner_no = miner_no
+        self.date = date
+        self.__dict__.update(values)
+
+
+class MinerDayColumnStore(object):
+
+    def __init__(self, column_dir):
+        with open(os.path.join(column_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.version = meta['version']
+        self.start_date = datetime.datetime.strptime(meta['start_date'], '%Y-%m-%d').date()
+        self.end_date = datetime.datetime.strptime(meta['end_date'], '%Y-%m-%d').date()
+        self.full_history = meta.get('full_history', False)
+        # 重建时MinerDay的update_time水位，旧版本缓存没有水位
+        self.update_time = datetime.datetime.strptime(meta['update_time'], _TIME_FORMAT) \
+            if meta.get('update_time') else None
+        self.miner_nos = meta['miner_nos']
+        self.miner_index = dict([(miner_no, i) for i, miner_no in enumerate(self.miner_nos)])
+        self.decimal_places = meta['decimal_places']
+
+        def _load(name):
+            return np.load(os.path.join(column_dir, name + '.npy'), mmap_mode='r')
+
+        self.exists = _load('exists')
+        self.arrays = {}
+        for field, places in self.decimal_places.items():
+            self.arrays[field] = (_load(field + '.hi'), _load(field + '.lo')) if places is not None else \
+                (_load(field), None)
+
+    def _value(self, field, hi, lo):
+        places = self.decimal_places[field]
+        if places is None:
+            return int(hi)
+        value = decimal.Decimal(int(hi) * _SPLIT + int(lo))
+        # 与数据库返回的小数位数保持一致，0.0000不会变成0E-4
+        return value.scaleb(-places).quantize(decimal.Decimal(10) ** -places) if places else value
+
+    def _offsets(self, start_date=None, end_date=None):
+        '''日期范围[start_date, end_date]对应的偏移区间，超出缓存范围时返回None'''
+        start_date = _to_date(start_date) or self.start_date
+        end_date = _to_date(end_date) or self.end_date
+        if start_date < self.start_date:
+            # 覆盖全部历史时，更早的日期本来就没有记录
+            if not self.full_history:
+                return None
+            start_date = self.start_date
+        start = (start_date - self.start_date).days
+        end = min((end_date - self.start_date).days, (self.end_date - self.start_date).days)
+        return start, max(end + 1, start)
+
+    def get_rows(self, miner_no, start_date=None, end_date=None, fields=None, limit=None):
+        '''
+        获取矿工[start_date, end_date]内的每日记录，按日期倒序，limit为最多返回的条数
+        超出缓存范围时返回None
+        '''
+        offsets = self._offsets(start_date, end_date)
+        if offsets is None:
+            return None
+        fields = fields or list(self.arrays.keys())
+        if any([x not in self.arrays for x in fields]):
+            return None
+        if miner_no not in self.miner_index:
+            return []
+        i = self.miner_index[miner_no]
+        start, end = offsets
+        day_offsets = (np.flatnonzero(self.exists[i, start:end])[::-1] + start)[:limit]
+        rows = []
+        for j in day_offsets:
+            values = {}
+            for field in fields:
+                hi, lo = self.arrays[field]
+                values[field] = self._value(field, hi[i, j], lo[i, j] if lo is not None else 0)
+            rows.append(MinerDayRow(miner_no, self.start_date + datetime.timedelta(days=int(j)), values))
+        return rows
+
+    def get_sums(self, miner_no, fields, start_date=None, end_date=None):
+        '''
+        获取矿工[start_date, end_date]内各字段的合计，返回(记录数, {字段: 合计})
+        超出缓存范围或字段没有缓存时返回None
+        '''
+        offsets = self._offsets(start_date, end_date)
+        if offsets is None or any([x not in self.arrays for x in fields]):
+            return None
+        if miner_no not in self.miner_index:
+            return 0, dict([(x, 0) for x in fields])
+        i = self.miner_index[miner_no]
+        start, end = offsets
+        mask = self.exists[i, start:end].astype(bool)
+        result = {}
+        for field in fields:
+            hi, lo = self.arrays[field]
+            result[field] = self._value(
+                field, hi[i, start:end][mask].sum(), lo[i, start:end][mask].sum() if lo is not None else 0)
+        return int(mask.sum()), result
+
+
+_store_lock = threading.Lock()
+_store_cache = {'store': None, 'checked': 0, 'latest_date': None, 'changed': False}
+
+
+def _get_latest_miner_day_date():
+    return MinerDay.objects.aggregate(Max('date'))['date__max']
+
+
+def _is_store_changed(store):
+    '''缓存重建之后是否有MinerDay记录变化(汽油费、过期质押等回写已缓存的日期)'''
+    if store.update_time is None:
+        return True
+    return MinerDay.objects.filter(update_time__gt=store.update_time).exists()
+
+
+def get_miner_day_store():
+    '''
+    获取当前进程的列式缓存
+    缓存不存在、数据库已经有缓存之后日期的记录、或缓存重建之后有记录变化时返回None，由调用方回退到数据库查询
+    '''
+    now = time.time()
+    with _store_lock:
+        if now - _store_cache['checked'] > _RELOAD_INTERVAL:
+            _store_cache['checked'] = now
+            column_dir = get_column_dir()
+            try:
+                with open(os.path.join(column_dir, 'meta.json')) as f:
+                    version = json.load(f)['version']
+                store = _store_cache['store']
+                if store is None or store.version != version:
+                    _store_cache['store'] = MinerDayColumnStore(column_dir)
+            except (IOError, OSError, ValueError, KeyError):
+                _store_cache['store'] = None
+            _store_cache['latest_date'] = _get_latest_miner_day_date()
+            if _store_cache['store'] is not None:
+                _store_cache['changed'] = _is_store_changed(_store_cache['store'])
+        store = _store_cache['store']
+        if store is None or not _store_cache['latest_date'] or store.end_date < _store_cache['latest_date'] or \
+                _store_cache['changed']:
+            return None
+        return store
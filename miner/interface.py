@@ -3,28 +3,160 @@ import math
 import json
 import logging
 import decimal
+import bisect
+import itertools
 import requests
 import datetime
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from lxml import etree
 
-from django.db import transaction
-from django.db.models import Avg, Q, F, Sum, Count
+from django.conf import settings
+from django.db import transaction, connections
+from django.db.models import Avg, Q, F, Sum, Count, Max, Case, When, Value
 
 from explorer_s_common.third.bbhe_mng_sdk import BbheMngBase
-from explorer_s_common import debug, consts, cache, raw_sql
+from explorer_s_common import debug, consts, cache
 from explorer_s_common.utils import format_return, Validator, format_power, format_price, format_fil, \
     str_2_power, format_fil_to_decimal, _d, get_aggregate_gas
 from explorer_s_common.decorator import validate_params, cache_required
 from explorer_s_common.third.filfox_sdk import FilfoxBase
 from explorer_s_common.third.bbhe_sdk import BbheBase, BbheEsBase
 from explorer_s_common.third.fam_sdk import FamBase
-import pandas as pd
 from tipset.interface import TipsetBase
 from deal.interface import DealBase
 from message.models import OvertimePledge
 from miner.models import Miner, MinerDayStat, MinerDay, MinerSyncLog, Company, CompanyMiner, \
-    MinerHotHistory
+    MinerHotHistory, MinerGasShardLog, MinerLeaderboard, MinerAddress
 from explorer_s_common.third.bbhe_louts_sdk import BbheLoutsBase
+from explorer_s_data.utils import prefetch_pages, iter_height_messages, iter_method_messages, TokenBucket
+from miner.columnar import get_miner_day_store, build_miner_day_columns
+
+# 历史快照中直接从矿工表复制的字段
+MINER_DAY_SNAPSHOT_FIELDS = [
+    'raw_power', 'power', 'sector_size', 'total_sector', 'active_sector', 'faulty_sector', 'recovering_sector',
+    'balance', 'available_balance', 'pledge_balance', 'initial_pledge_balance', 'locked_pledge_balance',
+    'total_reward', 'total_block_count', 'total_win_count', 'worker', 'worker_balance', 'worker_address',
+    'owner', 'owner_balance', 'owner_address', 'poster', 'poster_balance', 'poster_address'
+]
+
+# 每日汽油费累加字段
+MINER_DAY_GAS_FIELDS = [
+    'pre_gas', 'pre_gas_count', 'prove_gas', 'prove_gas_count', 'win_post_gas', 'win_post_gas_count', 'pledge_gas'
+]
+
+# 维护累计列(cum_字段)的字段
+MINER_DAY_CUM_FIELDS = [
+    'pre_gas', 'prove_gas', 'win_post_gas', 'pledge_gas', 'overtime_pledge_fee', 'block_reward', 'block_count',
+    'win_count', 'increase_power', 'increase_power_offset', 'lucky'
+]
+# 累计列，cum_day_count为截止当天(含)的记录条数
+MINER_DAY_CUM_COLUMNS = ['cum_' + x for x in MINER_DAY_CUM_FIELDS] + ['cum_day_count']
+
+# 累计列是否可用的进程内缓存
+_MINER_DAY_CUM_READY = {'ready': False, 'check_time': 0}
+
+# 同步有效矿工时从bbhe覆盖的矿工字段
+MINER_SYNC_FIELDS = [
+    'miner_address', 'raw_power', 'power', 'sector_size', 'total_sector', 'active_sector', 'faulty_sector',
+    'recovering_sector', 'balance', 'available_balance', 'pledge_balance', 'initial_pledge_balance',
+    'locked_pledge_balance', 'ip', 'peer_id', 'account_type', 'worker', 'worker_balance', 'worker_address',
+    'owner', 'owner_balance', 'owner_address', 'poster', 'poster_balance', 'poster_address', 'is_pool'
+]
+
+# 预先计算的排行榜时间窗口(天)与扇区类型
+LEADERBOARD_WINDOWS = [1, 7, 30]
+LEADERBOARD_SECTOR_TYPES = [None, '0', '1']
+# 各排序类型统计值的小数位数，与mysql聚合结果一致，None为整数
+LEADERBOARD_VALUE_PLACES = {
+    'increase_power': [4, 0],
+    'avg_reward': [8],
+    'block': [None, 8, 0],
+}
+
+# 地址索引维护的矿工字段，前两个为存储矿工本身的地址，其余为普通账户地址
+MINER_ADDRESS_STORE_ROLES = ['miner_no', 'miner_address']
+MINER_ADDRESS_ROLES = MINER_ADDRESS_STORE_ROLES + [
+    'owner', 'owner_address', 'worker', 'worker_address', 'poster', 'poster_address'
+]
+# 索引和es中都查不到的地址，在进程内缓存的时间(秒)和最大数量
+MINER_ADDRESS_MISS_TTL = 300
+MINER_ADDRESS_MISS_MAX = 100000
+
+_address_miss_lock = threading.Lock()
+_address_miss_cache = {}
+
+# 热表字段，同一槽位覆盖写入
+HOT_HISTORY_FIELDS = [
+    'record_time', 'raw_power', 'power', 'total_sector', 'active_sector', 'faulty_sector', 'recovering_sector',
+    'sector_size'
+]
+
+# 热表环形槽位数，30分钟一个，保留48小时
+HOT_HISTORY_SLOT_SECONDS = 30 * 60
+HOT_HISTORY_SLOTS = 96
+
+
+def _add_miner_gas_value(d, k, t, v, ps, s_c=1):
+    if k not in d:
+        d[k] = {
+            'pre_gas': 0, 'prove_gas': 0, 'win_post_gas': 0, 'pledge_gas': 0,
+            'pre_gas_count': 0, 'prove_gas_count': 0, 'win_post_gas_count': 0
+        }
+    d[k][t] += v
+    d[k]["pledge_gas"] += ps
+    d[k][t + '_count'] += s_c
+
+
+def add_miner_gas_messages(miner_gas_dict, messages):
+    '''按矿工累加一批消息的汽油费'''
+    for per in messages:
+        s = per['_source']
+        miner_no = s['msg_to']
+
+        # SubmitWindowedPoSt
+        if s['msg_method'] == 5:
+            # if s.get('msg_method_name') == 'SubmitWindowedPoSt':
+            _add_miner_gas_value(miner_gas_dict, miner_no, 'win_post_gas', _d(s['gascost_total_cost']),
+                                 _d(s['msg_value']))
+        # PreCommitSector PreCommitSectorBatch
+        if s['msg_method'] in [6, 25]:
+            # if s.get('msg_method_name') == 'PreCommitSector':
+            pre_agg_gas = _d(0)
+            sector_count = 1
+            if s['msg_method'] == 25:  # 多扇区封装
+                try:
+                    msg_params = json.loads(s.get("msg_params") or "{}")
+                    sector_count = max(len(msg_params.get("Sectors", [])), sector_count)
+                except:
+                    pass
+                if s.get('msgrct_exit_code', 0) == 0:
+                    pre_agg_gas = _d(get_aggregate_gas(sector_count, int(s["base_fee2"]),
+                                                       s["height"], s['msg_method']))
+            _add_miner_gas_value(miner_gas_dict, miner_no, 'pre_gas', _d(s['gascost_total_cost']) + pre_agg_gas,
+                                 _d(s['msg_value']), sector_count)
+        # ProveCommitSector ProveCommitAggregate
+        if s['msg_method'] in [7, 26]:
+            # if s.get('msg_method_name') == 'ProveCommitSector':
+            prove_agg_gas = _d(0)
+            sector_count = 1
+            if s['msg_method'] == 26:  # 多扇区封装
+                sector_count = max(s.get('sector_count', 0), sector_count)
+                if s.get('msgrct_exit_code', 0) == 0:
+                    prove_agg_gas = _d(get_aggregate_gas(sector_count, int(s["base_fee2"]),
+                                                         s["height"], s['msg_method']))
+            _add_miner_gas_value(miner_gas_dict, miner_no, 'prove_gas', _d(s['gascost_total_cost']) + prove_agg_gas,
+                                 _d(s['msg_value']), sector_count)
+    return miner_gas_dict
+
+
+def scan_miner_gas(start_height, end_height, search_step=120):
+    '''扫描高度区间[start_height, end_height)的消息，返回按矿工汇总的汽油费，供多进程分片调用'''
+    miner_gas_dict = {}
+    for batch_start, batch_end, hits in iter_height_messages(start_height, end_height, batch_size=search_step):
+        add_miner_gas_messages(miner_gas_dict, hits)
+    return miner_gas_dict
 
 
 class MinerBase(object):
@@ -56,9 +188,49 @@ class MinerBase(object):
         if not miner:
             return ranking
 
+        # 排名由同步有效矿工时预先计算，还没有计算过时实时统计
+        if miner.ranking:
+            return miner.ranking
         ranking = Miner.objects.filter(power__gt=miner.power).count() + 1
         return ranking
 
+    def get_miner_rankings(self, miners):
+        '''
+        批量获取矿工排名，与get_miner_ranking一致
+        没有预先计算排名的矿工，一次查询出大于最小算力的所有算力，二分查找算力更大的矿工数
+        '''
+        result = dict([(x.miner_no, x.ranking) for x in miners if x.ranking])
+        miners = [x for x in miners if not x.ranking]
+        if not miners:
+            return result
+        min_power = min([x.power for x in miners])
+        powers = sorted(Miner.objects.filter(power__gt=min_power).values_list('power', flat=True))
+        result.update([(x.miner_no, len(powers) - bisect.bisect_right(powers, x.power) + 1) for x in miners])
+        return result
+
+    def sync_miner_ranking(self, batch_size=500):
+        '''
+        按算力倒序一次遍历计算所有矿工的排名与同扇区类型排名，只写入有变化的矿工
+        排名为算力大于自己的矿工数+1，算力相同的矿工排名相同
+        '''
+        miners = Miner.objects.order_by('-power').only('id', 'power', 'sector_size', 'ranking', 'sector_ranking')
+        changed = []
+        # 全部矿工与每种扇区类型的(已遍历数量, 上一个算力, 上一个排名)
+        total = [0, None, 0]
+        sector_dict = {}
+        for miner in miners:
+            for counter in (total, sector_dict.setdefault(miner.sector_size, [0, None, 0])):
+                counter[0] += 1
+                if miner.power != counter[1]:
+                    counter[1], counter[2] = miner.power, counter[0]
+            ranking, sector_ranking = total[2], sector_dict[miner.sector_size][2]
+            if miner.ranking != ranking or miner.sector_ranking != sector_ranking:
+                miner.ranking, miner.sector_ranking = ranking, sector_ranking
+                changed.append(miner)
+        if changed:
+            Miner.objects.bulk_update(changed, ['ranking', 'sector_ranking'], batch_size=batch_size)
+        return len(changed)
+
     def get_miner_day_records(self, miner_no=None, date=None, start_date=None, end_date=None, order=None,
                               big_miner=None):
         '''获取指定日期的矿工记录'''
@@ -119,8 +291,8 @@ class MinerBase(object):
         if miner_no_list:
             objs = objs.filter(miner_no__in=miner_no_list)
         else:
-            miner_no_list = [miner.miner_no for miner in Miner.objects.filter().only("miner_no").all()]
-            objs = objs.filter(miner_no__in=miner_no_list)
+            # 子查询代替把全部矿工no带进sql
+            objs = objs.filter(miner_no__in=Miner.objects.values("miner_no"))
         objs = objs.values_list("miner_no")
         if filter_type == "increase_power":
             objs = objs.annotate(avg_increase_power=Avg("increase_power"),
@@ -139,6 +311,89 @@ class MinerBase(object):
         return self.get_miner_day_ranking_list(start_date, end_date, sector_type=sector_type, miner_no_list=miner_no_list,
                                                filter_type=filter_type)
 
+    def _get_leaderboard_sector_type(self, sector_type):
+        return int(sector_type) if sector_type in ('0', '1') else -1
+
+    def get_miner_leaderboard(self, start_date, end_date, sector_type=None, filter_type="increase_power"):
+        '''
+        获取预先计算的排行榜，按排名排序
+        不是标准时间窗口、还没有计算、或者在end_date的历史快照完成之前计算的(数据不完整)返回None
+        '''
+        if not start_date or not end_date:
+            return None
+        objs = MinerLeaderboard.objects.filter(
+            start_date=start_date, end_date=end_date, filter_type=filter_type,
+            sector_type=self._get_leaderboard_sector_type(sector_type)
+        ).order_by('rank')
+        first = objs.first()
+        if first is None:
+            return None
+        sync_log = MinerSyncLog.objects.filter(date=end_date).exclude(history_sync_time=None).first()
+        if not sync_log or first.create_time < sync_log.history_sync_time:
+            return None
+        return objs
+
+    def get_miner_leaderboard_page(self, objs, page_index, page_size, filter_type="increase_power"):
+        '''
+        按排名区间读取排行榜的一页，代替OFFSET分页和COUNT
+        同一个排行榜的排名从1开始连续，总数即最大排名
+        '''
+        total_count = objs.order_by('-rank').values_list('rank', flat=True).first() or 0
+        page_objs = objs.filter(rank__gt=(page_index - 1) * page_size, rank__lte=page_index * page_size)
+        return {
+            'objects': self.format_leaderboard_rows(page_objs, filter_type=filter_type),
+            'total_count': total_count, 'total_page': int(math.ceil(total_count / page_size)) if page_size else 0
+        }
+
+    def format_leaderboard_rows(self, objs, filter_type="increase_power"):
+        '''把排行榜记录还原成get_miner_day_ranking_list返回的元组'''
+        places = LEADERBOARD_VALUE_PLACES[filter_type]
+        result = []
+        for obj in objs:
+            values = [obj.value1, obj.value2, obj.value3][:len(places)]
+            values = [int(v) if p is None else v.quantize(decimal.Decimal(10) ** -p) for v, p in zip(values, places)]
+            result.append(tuple([obj.miner_no] + values))
+        return result
+
+    def sync_miner_leaderboard(self, end_date=None, keep_days=2, batch_size=1000):
+        '''
+        每晚计算标准时间窗口的多日排行榜
+        窗口为[end_date - N天, end_date]，与按出块排序接口的日期范围一致
+        '''
+        _time_start = time.time()
+        if not end_date:
+            end_date = datetime.date.today() - datetime.timedelta(days=1)
+        if isinstance(end_date, str):
+            end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
+
+        count = 0
+        for days in LEADERBOARD_WINDOWS:
+            start_date = end_date - datetime.timedelta(days=days)
+            for sector_type in LEADERBOARD_SECTOR_TYPES:
+                for filter_type in LEADERBOARD_VALUE_PLACES.keys():
+                    rows = self.get_miner_day_ranking_list(start_date, end_date, sector_type=sector_type,
+                                                           filter_type=filter_type)
+                    objs = []
+                    for rank, row in enumerate(rows, 1):
+                        values = list(row[1:]) + [0] * (4 - len(row))
+                        objs.append(MinerLeaderboard(
+                            start_date=start_date, end_date=end_date, filter_type=filter_type,
+                            sector_type=self._get_leaderboard_sector_type(sector_type), rank=rank,
+                            miner_no=row[0], value1=values[0] or 0, value2=values[1] or 0, value3=values[2] or 0
+                        ))
+                    with transaction.atomic():
+                        MinerLeaderboard.objects.filter(
+                            start_date=start_date, end_date=end_date, filter_type=filter_type,
+                            sector_type=self._get_leaderboard_sector_type(sector_type)
+                        ).delete()
+                        MinerLeaderboard.objects.bulk_create(objs, batch_size=batch_size)
+                    count += len(objs)
+
+        # 只保留最近几天的排行榜
+        MinerLeaderboard.objects.filter(end_date__lt=end_date - datetime.timedelta(days=keep_days)).delete()
+        logging.warning('计算排行榜耗时: %s s, 写入 %s 行' % (time.time() - _time_start, count))
+        return format_return(0, data=count)
+
     @cache_required("get_miner_day_total_block_reward_%s", expire=60 * 24)
     def get_miner_day_total_block_reward(self, cl, start_date, end_date):
         """获取指定日期的出块总数"""
@@ -147,25 +402,29 @@ class MinerBase(object):
         return total_block_reward
 
     @cache_required("miner_day_records_for_month_avg_value_%s", expire=60 * 60 * 24)
-    def get_miner_day_records_for_month_avg_value(self, date, order, data_queryset):
+    def get_miner_day_records_for_month_avg_value(self, ck, date, order, data_queryset):
         """
         获得平均值的评分
+        ck: 缓存key，按(日期, big_miner)区分
+        按矿工分组求和/计数得到平均值，再拼接最后一天的记录，按平均值倒序
         """
         data_field = order
-        # 转为data frame 重构结构
-        base_df = pd.DataFrame(list(data_queryset.values()))
-        avg_df = base_df[["date", 'miner_no', data_field]]
-        pivot_df = avg_df.pivot(index="miner_no", columns="date", values=data_field)
-        mean_series = pivot_df.mean(skipna=True, axis=1)
-        mean_dict = {"miner_no": mean_series.index, "mean_avg": mean_series.values}
-        mean_df = pd.DataFrame(mean_dict)
+        mean_dict = {}
+        for miner_no, total, count in data_queryset.values_list("miner_no").annotate(
+                total=Sum(data_field), count=Count("id")).order_by():
+            if count:
+                mean_dict[miner_no] = float(total) / count
         # 获得今日的算力,扇区质押,用于拼接到月平均算力
-        today = pd.DataFrame(base_df)["date"].max()
-        today_df = base_df[base_df['date'] == today]
-        result_df = pd.merge(mean_df, today_df, how='inner', on='miner_no')
+        today = data_queryset.aggregate(Max("date"))["date__max"]
+        result = []
+        for record in data_queryset.filter(date=today).values():
+            if record["miner_no"] not in mean_dict:
+                continue
+            record["mean_avg"] = mean_dict[record["miner_no"]]
+            result.append(record)
         # 排序
-        result_df = result_df.sort_values(by=['mean_avg'], axis=0, ascending=False)
-        return result_df.to_dict(orient="records")
+        result.sort(key=lambda x: x["mean_avg"], reverse=True)
+        return result
 
     def get_companys(self, company_code):
         '''获取所有矿商'''
@@ -197,46 +456,78 @@ class MinerBase(object):
         data = BbheEsBase().get_148888_active_miners()['hits']
         return dict([(x['_source']['miner_id'], x['_source']) for x in data])
 
-    def add_miner_hot_history(self, data):
-        '''添加矿工48小时热表数据'''
-        now = datetime.datetime.now()
+    def get_hot_history_record_time(self, now=None):
+        '''获取热表当前所在的30分钟槽位时间'''
+        now = now or datetime.datetime.now()
         minute = math.floor(now.minute / 30) * 30
-        record_time = datetime.datetime(now.year, now.month, now.day, now.hour, minute, 0)
-        obj, created = MinerHotHistory.objects.get_or_create(miner_no=data['miner_no'], record_time=record_time)
-        if created:
-            obj.raw_power = data['raw_power']
-            obj.power = data['power']
-            obj.total_sector = data['total_sector']
-            obj.active_sector = data['active_sector']
-            obj.faulty_sector = data['faulty_sector']
-            obj.recovering_sector = data['recovering_sector']
-            obj.sector_size = data['sector_size']
-            obj.save()
+        return datetime.datetime(now.year, now.month, now.day, now.hour, minute, 0)
+
+    def get_hot_history_slot(self, record_time):
+        '''热表环形槽位，从主网上线开始每30分钟一个，共HOT_HISTORY_SLOTS个'''
+        return int((record_time - self.launch_date).total_seconds() // HOT_HISTORY_SLOT_SECONDS) % HOT_HISTORY_SLOTS
+
+    def _fill_hot_history(self, obj, data, record_time):
+        '''将矿工数据写入热表槽位(不保存)'''
+        obj.record_time = record_time
+        obj.raw_power = data['raw_power']
+        obj.power = data['power']
+        obj.total_sector = data['total_sector']
+        obj.active_sector = data['active_sector']
+        obj.faulty_sector = data['faulty_sector']
+        obj.recovering_sector = data['recovering_sector']
+        obj.sector_size = data['sector_size']
+        return obj
+
+    def rebuild_hot_history_slots(self, batch_size=500):
+        '''
+        按record_time重新计算热表槽位，同一矿工同一槽位只保留最新的记录
+        改为环形槽位之前的记录slot都是0，加(miner_no, slot)唯一索引之前需要先回填
+        '''
+        _time_start = time.time()
+        now = datetime.datetime.now()
+        keep = {}
+        delete_ids = []
+        for record_id, miner_no, record_time, slot in MinerHotHistory.objects.values_list(
+                'id', 'miner_no', 'record_time', 'slot').order_by('-record_time', '-id').iterator():
+            key = (miner_no, self.get_hot_history_slot(record_time))
+            if key in keep:
+                delete_ids.append(record_id)
+            else:
+                keep[key] = (record_id, slot)
+        updates = [(record_id, key[1]) for key, (record_id, slot) in keep.items() if key[1] != slot]
+
+        with transaction.atomic():
+            for i in range(0, len(delete_ids), batch_size):
+                MinerHotHistory.objects.filter(id__in=delete_ids[i:i + batch_size]).delete()
+            # 先写入临时的负数槽位，已有唯一索引时不会与尚未更新的记录冲突
+            MinerHotHistory.objects.bulk_update([
+                MinerHotHistory(id=record_id, slot=-1 - slot, update_time=now) for record_id, slot in updates
+            ], ['slot', 'update_time'], batch_size=batch_size)
+            MinerHotHistory.objects.bulk_update([
+                MinerHotHistory(id=record_id, slot=slot, update_time=now) for record_id, slot in updates
+            ], ['slot', 'update_time'], batch_size=batch_size)
+
+        logging.warning('回填热表槽位耗时: %s s, 删除 %s, 更新 %s' % (
+            time.time() - _time_start, len(delete_ids), len(updates)))
+        return format_return(0, data={'delete': len(delete_ids), 'update': len(updates)})
 
-    def clear_miner_hot_history(self, days=2):
-        '''定期清除热表历史记录'''
-        delete_time = datetime.datetime.now() - datetime.timedelta(days=days)
-        MinerHotHistory.objects.filter(record_time__lte=delete_time).delete()
+    def add_miner_hot_history(self, data):
+        '''添加矿工48小时热表数据，覆盖上一轮同一槽位的记录'''
+        record_time = self.get_hot_history_record_time()
+        slot = self.get_hot_history_slot(record_time)
+        obj, created = MinerHotHistory.objects.get_or_create(
+            miner_no=data['miner_no'], slot=slot, defaults={'record_time': record_time})
+        # 同一个30分钟内只保留第一次写入的数据
+        if created or obj.record_time != record_time:
+            self._fill_hot_history(obj, data, record_time)
+            obj.save()
 
     def get_24h_power_increase(self, miner_no):
         '''获取24小时封装量、算力增量'''
-        now_record = MinerHotHistory.objects.filter(miner_no=miner_no)
-        if not now_record:
-            return 0, 0
-        now_record = now_record[0]
-
-        last_time = now_record.record_time - datetime.timedelta(days=1)
-        last_record = MinerHotHistory.objects.filter(miner_no=miner_no, record_time__lte=last_time)
-        if not last_record:
-            return now_record.total_sector * now_record.sector_size, now_record.power
-        last_record = last_record[0]
-        # 计算封装量、算力增量
-        increase_power = (now_record.total_sector - last_record.total_sector) * now_record.sector_size
-        increase_power_offset = now_record.power - last_record.power
-        return increase_power, increase_power_offset
+        return self.get_24h_power_increase_all(miner_no=miner_no).get(miner_no, (0, 0))
 
-    def update_miner_data(self, data, pool_miners=[]):
-        miner, created = Miner.objects.get_or_create(miner_no=data['miner_no'])
+    def _fill_miner(self, miner, data, pool_miners=[]):
+        '''将bbhe矿工数据写入Miner对象(不保存)'''
         miner.miner_address = data['miner_address']
         miner.raw_power = data['raw_power']
         miner.power = data['power']
@@ -270,84 +561,377 @@ class MinerBase(object):
             miner.is_pool = True
         else:
             miner.is_pool = False
+        return miner
+
+    def _calc_24h_power_increase(self, now_record, last_record):
+        '''根据当前与24小时前的热表记录(record_time, power, total_sector, sector_size)计算增量'''
+        if last_record is None:
+            return now_record[2] * now_record[3], now_record[1]
+        return (now_record[2] - last_record[2]) * now_record[3], now_record[1] - last_record[1]
+
+    def get_24h_power_increase_all(self, miner_no=None, chunk_size=500):
+        '''
+        获取所有矿工的24小时封装量、算力增量，返回{miner_no: (increase_power, increase_power_offset)}
+        当前槽位与24小时前的槽位直接按槽位号计算，只查两个槽位
+        本轮没有写入当前槽位、或24小时前槽位记录对不上的矿工，再按该矿工全部槽位计算
+        '''
+        fields = ('miner_no', 'slot', 'record_time', 'power', 'total_sector', 'sector_size')
+        objs = MinerHotHistory.objects.filter()
+        if miner_no:
+            objs = objs.filter(miner_no=miner_no)
+        now_time = objs.aggregate(Max('record_time'))['record_time__max']
+        if not now_time:
+            return {}
+        last_time = now_time - datetime.timedelta(days=1)
+        now_slot = self.get_hot_history_slot(now_time)
+        last_slot = self.get_hot_history_slot(last_time)
+
+        now_dict, last_dict = {}, {}
+        for record in objs.filter(slot__in=[now_slot, last_slot]).values_list(*fields).order_by():
+            if record[1] == now_slot and record[2] == now_time:
+                now_dict[record[0]] = record[2:]
+            elif record[1] == last_slot and record[2] == last_time:
+                last_dict[record[0]] = record[2:]
+
+        result = {}
+        for key, now_record in now_dict.items():
+            if key in last_dict:
+                result[key] = self._calc_24h_power_increase(now_record, last_dict[key])
+
+        # 槽位对不上的矿工，按时间倒序找第一条早于24小时的记录
+        # 环形槽位不再删除旧数据，超过48小时未覆盖的记录视为过期
+        objs = objs.filter(record_time__gt=now_time - datetime.timedelta(days=2))
+        other_nos = set(objs.values_list('miner_no', flat=True).distinct().order_by()) - set(result.keys())
+        other_nos = sorted(other_nos)
+        for i in range(0, len(other_nos), chunk_size):
+            records = objs.filter(miner_no__in=other_nos[i:i + chunk_size]).order_by(
+                'miner_no', '-record_time').values_list(*fields)
+            for key, group in itertools.groupby(records, key=lambda x: x[0]):
+                now_record = next(group)[2:]
+                last_time = now_record[0] - datetime.timedelta(days=1)
+                last_record = next((x[2:] for x in group if x[2] <= last_time), None)
+                result[key] = self._calc_24h_power_increase(now_record, last_record)
+        return result
+
+    def update_miner_data(self, data, pool_miners=[]):
+        miner, created = Miner.objects.get_or_create(miner_no=data['miner_no'])
+        self._fill_miner(miner, data, pool_miners=pool_miners)
         miner.save()
+        self.sync_miner_addresses([miner])
 
         stat, created = MinerDayStat.objects.get_or_create(miner=miner)
         stat.lucky = data['lucky']
         stat.save()
 
+    def update_miner_data_batch(self, data_list, pool_miners=[]):
+        '''
+        按页批量写入矿工数据、24h状态和热表记录
+        每张表只查询一次已有记录，然后使用bulk_create/bulk_update写回，返回写入行数
+        '''
+        if not data_list:
+            return 0
+        now = datetime.datetime.now()
+        data_dict = dict([(x['miner_no'], x) for x in data_list])
+        miner_nos = list(data_dict.keys())
+
+        with transaction.atomic():
+            # 矿工表
+            miner_dict = dict([(x.miner_no, x) for x in Miner.objects.filter(miner_no__in=miner_nos)])
+            new_miners = []
+            for miner_no, data in data_dict.items():
+                miner = miner_dict.get(miner_no)
+                if miner is None:
+                    new_miners.append(self._fill_miner(Miner(miner_no=miner_no), data, pool_miners=pool_miners))
+                    continue
+                self._fill_miner(miner, data, pool_miners=pool_miners)
+                # bulk_update不会触发auto_now，需要手动刷新更新时间
+                miner.update_time = now
+            if miner_dict:
+                Miner.objects.bulk_update(list(miner_dict.values()), MINER_SYNC_FIELDS + ['update_time'])
+            if new_miners:
+                Miner.objects.bulk_create(new_miners)
+                # mysql下bulk_create不会回填主键，重新查询一次
+                miner_dict.update(dict([(x.miner_no, x) for x in Miner.objects.filter(
+                    miner_no__in=[m.miner_no for m in new_miners])]))
+
+            # 地址索引
+            address_count = self.sync_miner_addresses(list(miner_dict.values()))
+
+            # 24h状态表，只更新幸运值
+            stat_dict = dict([(x.miner_id, x) for x in MinerDayStat.objects.filter(
+                miner_id__in=[x.id for x in miner_dict.values()])])
+            new_stats = []
+            for miner_no, miner in miner_dict.items():
+                stat = stat_dict.get(miner.id)
+                if stat is None:
+                    new_stats.append(MinerDayStat(miner=miner, lucky=data_dict[miner_no]['lucky']))
+                    continue
+                stat.lucky = data_dict[miner_no]['lucky']
+                stat.update_time = now
+            if stat_dict:
+                MinerDayStat.objects.bulk_update(list(stat_dict.values()), ['lucky', 'update_time'])
+            if new_stats:
+                MinerDayStat.objects.bulk_create(new_stats)
+
+            # 48小时热表，每30分钟一个槽位，覆盖上一轮同一槽位的记录
+            record_time = self.get_hot_history_record_time(now)
+            slot = self.get_hot_history_slot(record_time)
+            history_dict = dict([(x.miner_no, x) for x in MinerHotHistory.objects.filter(
+                slot=slot, miner_no__in=miner_nos)])
+            new_histories = []
+            update_histories = []
+            for miner_no, data in data_dict.items():
+                history = history_dict.get(miner_no)
+                if history is None:
+                    new_histories.append(self._fill_hot_history(
+                        MinerHotHistory(miner_no=miner_no, slot=slot), data, record_time))
+                    continue
+                # 同一个30分钟内只保留第一次写入的数据
+                if history.record_time == record_time:
+                    continue
+                self._fill_hot_history(history, data, record_time)
+                history.update_time = now
+                update_histories.append(history)
+            if update_histories:
+                MinerHotHistory.objects.bulk_update(update_histories, HOT_HISTORY_FIELDS + ['update_time'])
+            if new_histories:
+                MinerHotHistory.objects.bulk_create(new_histories)
+
+        return len(miner_dict) + address_count + len(stat_dict) + len(new_stats) + len(new_histories) + \
+            len(update_histories)
+
+    def _is_address_miss(self, address):
+        '''地址是否在最近MINER_ADDRESS_MISS_TTL秒内已确认不存在'''
+        with _address_miss_lock:
+            miss_time = _address_miss_cache.get(address)
+            if miss_time is None:
+                return False
+            if time.time() - miss_time > MINER_ADDRESS_MISS_TTL:
+                _address_miss_cache.pop(address, None)
+                return False
+            return True
+
+    def _add_address_miss(self, address):
+        with _address_miss_lock:
+            if len(_address_miss_cache) >= MINER_ADDRESS_MISS_MAX:
+                _address_miss_cache.clear()
+            _address_miss_cache[address] = time.time()
+
     def get_miner_type(self, miner_no):
-        # 数据可能存在的字段
-        field_list_common = ["owner", "owner_address", "worker", "worker_address", "poster", "poster_address"]
-        field_list_store = ["miner_no", "miner_address"]
-        objs = Miner.objects.filter(
-            Q(owner=miner_no) | Q(owner_address=miner_no) | Q(worker=miner_no) | Q(worker_address=miner_no) |
-            Q(poster=miner_no) | Q(poster_address=miner_no) | Q(miner_no=miner_no) | Q(miner_address=miner_no))
-        if not objs:
-            data = objs[0].__dict__
+        '''
+        根据地址判断矿工类型，存储矿工返回store，普通账户返回common，找不到返回-1
+        先查地址索引，查不到再去es中查找，es也查不到的地址缓存一段时间
+        '''
+        roles = set(MinerAddress.objects.filter(address=miner_no).values_list('role', flat=True))
+        if roles:
+            return "store" if roles.issubset(MINER_ADDRESS_STORE_ROLES) else "common"
+        if self._is_address_miss(miner_no):
+            return -1
+
+        field_list_common = ["owner_id", "owner_address", "worker_id", "worker_address", "poster_id",
+                             "poster_address"]
+        # 数据库中没有找到的话,需要去es中查找
+        result = BbheEsBase().get_miner_info_by_address(miner_no)
+        if result.get("hits"):
+            data = result.get("hits")[0].get("_source")
             data = dict([val, key] for key, val in data.items() if isinstance(val, str))
             key = data.get(miner_no)
             if key in field_list_common:
                 return "common"
             else:
                 return "store"
-        else:
-            field_list_common = ["owner_id", "owner_address", "worker_id", "worker_address", "poster_id",
-                                 "poster_address"]
-            field_list_store = ["miner_id", "miner_address"]
-
-            # 数据库中没有找到的话,需要去es中查找
-            result = BbheEsBase().get_miner_info_by_address(miner_no)
-            if result.get("hits"):
-                data = result.get("hits")[0].get("_source")
-                data = dict([val, key] for key, val in data.items() if isinstance(val, str))
-                key = data.get(miner_no)
-                if key in field_list_common:
-                    return "common"
-                else:
-                    return "store"
-            else:
-                data = -1
-            return data
+        self._add_address_miss(miner_no)
+        return -1
 
-    def sync_active_miners(self):
+    def sync_miner_addresses(self, miners):
         '''
-        同步有效矿工
+        按矿工增量同步地址索引，只写入有变化的记录，返回写入行数
+        '''
+        if not miners:
+            return 0
+        now = datetime.datetime.now()
+        exist_dict = dict([((x.miner_no, x.role), x) for x in MinerAddress.objects.filter(
+            miner_no__in=[x.miner_no for x in miners])])
+        new_objs, update_objs, delete_ids = [], [], []
+        for miner in miners:
+            for role in MINER_ADDRESS_ROLES:
+                address = getattr(miner, role)
+                obj = exist_dict.pop((miner.miner_no, role), None)
+                if not address:
+                    if obj is not None:
+                        delete_ids.append(obj.id)
+                    continue
+                if obj is None:
+                    new_objs.append(MinerAddress(address=address, miner_no=miner.miner_no, role=role))
+                elif obj.address != address:
+                    obj.address = address
+                    obj.update_time = now
+                    update_objs.append(obj)
+        # 不再维护的地址类型
+        delete_ids.extend([x.id for x in exist_dict.values()])
+
+        if delete_ids:
+            MinerAddress.objects.filter(id__in=delete_ids).delete()
+        if update_objs:
+            MinerAddress.objects.bulk_update(update_objs, ['address', 'update_time'])
+        if new_objs:
+            MinerAddress.objects.bulk_create(new_objs)
+        return len(new_objs) + len(update_objs) + len(delete_ids)
+
+    def rebuild_miner_address(self, chunk_size=500):
         '''
+        根据矿工表重建地址索引，用于首次上线或修复索引
+        '''
+        row_count = 0
+        last_id = 0
+        while True:
+            miners = list(Miner.objects.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not miners:
+                break
+            with transaction.atomic():
+                row_count += self.sync_miner_addresses(miners)
+            last_id = miners[-1].id
+        # 矿工表中已经不存在的矿工
+        miner_nos = set(Miner.objects.values_list('miner_no', flat=True))
+        stale_nos = set(MinerAddress.objects.values_list('miner_no', flat=True).distinct().order_by()) - miner_nos
+        stale_nos = list(stale_nos)
+        for i in range(0, len(stale_nos), chunk_size):
+            row_count += MinerAddress.objects.filter(miner_no__in=stale_nos[i:i + chunk_size]).delete()[0]
+        return format_return(0, data=row_count)
+
+    def get_active_miner_pages(self, page_size=100, prefetch=2):
+        '''
+        分页遍历bbhe有效矿工，后台预取后续prefetch页
+        遇到第一个空页停止
+        '''
+        def _fetch(page_index):
+            result = BbheBase().get_active_miners(page_index=page_index, page_size=page_size)
+            return (result or {}).get('data', [])
+
+        return prefetch_pages(_fetch, depth=prefetch)
 
+    def sync_active_miners(self, bulk=True, prefetch=2, last_seen_count=None, force=False):
+        '''
+        同步有效矿工
+        bulk: 按页批量写入，False时逐个矿工写入
+        prefetch: 后台预取的页数
+        last_seen_count: 上一次同步到的矿工数，force: 跳过完整性检查直接删除，见purge_stale_miners
+        返回本次同步到的矿工数(seen_count)和删除的矿工数
+        '''
+        _time_start = time.time()
         pool_miners = FamBase().get_pool_miners()['data']
         # pool_miners=[]
-        page_index = 0
         page_size = 100
-        result = BbheBase().get_active_miners(page_index=page_index, page_size=page_size)
-        if not result:
-            return format_return(0)
-
-        while result.get('data', []):
-            for per in result.get('data', []):
-                self.update_miner_data(data=per, pool_miners=pool_miners)
-                self.add_miner_hot_history(data=per)
 
-            page_index += 1
-            result = BbheBase().get_active_miners(page_index=page_index, page_size=page_size)
+        row_count = 0
+        seen_miner_nos = set()
+        for data_list in self.get_active_miner_pages(page_size=page_size, prefetch=prefetch):
+            seen_miner_nos.update([x['miner_no'] for x in data_list])
+            if bulk:
+                row_count += self.update_miner_data_batch(data_list=data_list, pool_miners=pool_miners)
+            else:
+                for per in data_list:
+                    self.update_miner_data(data=per, pool_miners=pool_miners)
+                    self.add_miner_hot_history(data=per)
+                    row_count += 3
+        _time_cost = time.time() - _time_start
+        logging.warning('同步有效矿工耗时: %s s, 写入 %s 行, %s 行/s' % (
+            _time_cost, row_count, int(row_count / _time_cost) if _time_cost else row_count))
+
+        # 删掉本次没有同步到的老数据
+        purge_count = self.purge_stale_miners(seen_miner_nos, last_seen_count=last_seen_count, force=force)
+
+        # 算力更新后重新计算排名
+        self.sync_miner_ranking()
+        return format_return(0, data={'seen_count': len(seen_miner_nos), 'purge_count': purge_count})
+
+    def purge_stale_miners(self, seen_miner_nos, last_seen_count=None, force=False, min_ratio=0.9, chunk_size=500):
+        '''
+        按集合删除本次同步没有出现的矿工
+        seen_miner_nos少于上一次同步矿工数(last_seen_count)的min_ratio时认为bbhe数据不完整，跳过删除
+        上一次的数量由调用方保存，下一轮以本次数量为准，矿工数真实下降时只会推迟一轮删除
+        没有上一次的数量时与现有矿工数比较，force为True时不检查
+        '''
+        miner_ids = dict(Miner.objects.values_list('miner_no', 'id'))
+        base_count = len(miner_ids) if last_seen_count is None else last_seen_count
+        if not force and len(seen_miner_nos) < base_count * min_ratio:
+            logging.warning('本次同步矿工数 %s 少于上次同步矿工数 %s 的 %s，跳过删除' % (
+                len(seen_miner_nos), base_count, min_ratio))
+            return 0
+
+        stale_nos = [miner_no for miner_no in miner_ids.keys() if miner_no not in seen_miner_nos]
+        stale_ids = [miner_ids[miner_no] for miner_no in stale_nos]
+        for i in range(0, len(stale_ids), chunk_size):
+            chunk = stale_ids[i:i + chunk_size]
+            with transaction.atomic():
+                MinerDayStat.objects.filter(miner_id__in=chunk).delete()
+                # 热表槽位只会被同一矿工覆盖，矿工删除时一并清除
+                MinerHotHistory.objects.filter(miner_no__in=stale_nos[i:i + chunk_size]).delete()
+                MinerAddress.objects.filter(miner_no__in=stale_nos[i:i + chunk_size]).delete()
+                Miner.objects.filter(id__in=chunk).delete()
+        if stale_ids:
+            logging.warning('删除过期矿工 %s 个' % len(stale_ids))
+        return len(stale_ids)
+
+    def sync_miner_join_time(self, rate=2, max_workers=4, save_per_count=50, limit=None):
+        '''
+        回填矿工加入时间
+        rate: 每秒请求filfox的次数
+        max_workers: 并发请求数
+        失败的矿工按失败次数退避(最长24小时)，避免每次都重试
+        '''
+        _time_start = time.time()
+        now = datetime.datetime.now()
+        miners = []
+        for miner in Miner.objects.filter(join_time__isnull=True).order_by('join_time_fail_count', 'id'):
+            if miner.join_time_sync_time and miner.join_time_fail_count:
+                backoff = datetime.timedelta(hours=min(2 ** miner.join_time_fail_count, 24))
+                if miner.join_time_sync_time > now - backoff:
+                    continue
+            miners.append(miner)
+            if limit and len(miners) >= limit:
+                break
+        if not miners:
+            return format_return(0, data={'success': 0, 'fail': 0})
+
+        bucket = TokenBucket(rate=rate)
+
+        def _fetch(miner):
+            bucket.acquire()
+            try:
+                result = FilfoxBase().get_miner_overview(miner.miner_no) or {}
+            except Exception as e:
+                logging.warning('获取矿工加入时间失败 %s %s' % (miner.miner_no, e))
+                return miner, None
+            return miner, result.get('createTimestamp')
+
+        def _save(objs):
+            Miner.objects.bulk_update(objs, ['join_time', 'join_time_fail_count', 'join_time_sync_time'])
 
-        # 删掉老数据
-        date = datetime.datetime.now().strftime('%Y-%m-%d') + ' 00:00:00'
-        for miner in Miner.objects.filter(update_time__lte=date):
-            MinerDayStat.objects.filter(miner=miner).delete()
-            miner.delete()
-
-        # 同步矿工创建时间
-        for miner in Miner.objects.filter(join_time__isnull=True):
-            result = FilfoxBase().get_miner_overview(miner.miner_no)
-            if result.get('createTimestamp'):
-                miner.join_time = datetime.datetime.fromtimestamp(result['createTimestamp'])
-            miner.save()
-            time.sleep(1)
-
-        # 定期清除热表历史记录
-        self.clear_miner_hot_history()
-        return format_return(0)
+        success = 0
+        fail = 0
+        objs = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_fetch, miner) for miner in miners]
+            for future in as_completed(futures):
+                miner, create_timestamp = future.result()
+                miner.join_time_sync_time = datetime.datetime.now()
+                if create_timestamp:
+                    miner.join_time = datetime.datetime.fromtimestamp(create_timestamp)
+                    success += 1
+                else:
+                    miner.join_time_fail_count += 1
+                    fail += 1
+                objs.append(miner)
+                # 分批保存
+                if len(objs) >= save_per_count:
+                    _save(objs)
+                    objs = []
+        if objs:
+            _save(objs)
+
+        logging.warning('同步矿工加入时间耗时: %s s, 成功 %s, 失败 %s' % (time.time() - _time_start, success, fail))
+        return format_return(0, data={'success': success, 'fail': fail})
 
     def sync_pool_miners(self):
         '''同步矿池矿工'''
@@ -370,13 +954,26 @@ class MinerBase(object):
 
     def sync_miner_temp_stat(self, miner_no=None):
         '''同步累计统计信息'''
-        success = 0
+        _time_start = time.time()
+        now = datetime.datetime.now()
         data = TipsetBase().get_temp_tipset_stat(miner_no=miner_no)
         dict_block_info = dict([(x[0], x) for x in data])
+        # 一次查询所有矿工的24小时算力增量
+        power_increase_dict = self.get_24h_power_increase_all(miner_no=miner_no)
+
+        miners = Miner.objects.filter()
+        if miner_no:
+            miners = miners.filter(miner_no=miner_no)
+        miners = list(miners)
+        stat_dict = dict([(x.miner_id, x) for x in MinerDayStat.objects.filter(miner_id__in=[m.id for m in miners])])
 
-        for miner in Miner.objects.filter():
+        new_stats = []
+        for miner in miners:
             temp = dict_block_info.get(miner.miner_no)
-            stat, created = MinerDayStat.objects.get_or_create(miner=miner)
+            stat = stat_dict.get(miner.id)
+            if stat is None:
+                stat = MinerDayStat(miner=miner)
+                new_stats.append(stat)
             stat.block_reward = temp[1] if temp else 0
             stat.win_count = temp[2] if temp else 0
             stat.block_count = temp[3] if temp else 0
@@ -384,25 +981,89 @@ class MinerBase(object):
             avg_reward = stat.block_reward / (miner.power / _d(math.pow(1024, 4))) if miner.power else 0
             stat.avg_reward = avg_reward / _d(math.pow(10, 18))
             # 计算24小时算力增速、增量
-            increase_power, increase_power_offset = self.get_24h_power_increase(miner_no=miner.miner_no)
-            stat.increase_power = increase_power
-            stat.increase_power_offset = increase_power_offset
-            stat.save()
-            success += 1
-
+            stat.increase_power, stat.increase_power_offset = power_increase_dict.get(miner.miner_no, (0, 0))
+            stat.update_time = now
+
+        with transaction.atomic():
+            if stat_dict:
+                MinerDayStat.objects.bulk_update(list(stat_dict.values()), [
+                    'block_reward', 'win_count', 'block_count', 'avg_reward', 'increase_power',
+                    'increase_power_offset', 'update_time'
+                ], batch_size=1000)
+            if new_stats:
+                MinerDayStat.objects.bulk_create(new_stats, batch_size=1000)
+
+        success = len(miners)
+        logging.warning('同步矿工24小时状态耗时: %s s, 矿工数 %s' % (time.time() - _time_start, success))
         return format_return(0, data={'success': success})
 
-    def sync_miner_lotus(self):
-        '''链上价格和piece_size'''
-        for miner in Miner.objects.filter():
-            result_louts = BbheLoutsBase().bill_to_miner_no(miner.miner_no)
-            if result_louts.get("code") == 0:
-                miner.max_pieceSize = result_louts.get("data").get("max_piece_size", "0")
-                miner.min_pieceSize = result_louts.get("data").get("min_piece_size", "0")
-                miner.price = result_louts.get("data").get("price", "0")
-                miner.verified_price = result_louts.get("data").get("verified_price", "0")
-                miner.save()
-        return format_return(0, )
+    def sync_miner_lotus(self, max_workers=8, timeout=10, batch_size=500, max_abandoned=32):
+        '''
+        链上价格和piece_size
+        同时最多max_workers个请求，一个完成就补一个，每个请求超过timeout秒放弃
+        放弃的请求不能取消，线程会继续运行到结束，线程池多留max_abandoned个线程给它们，不占用新请求的名额
+        放弃的请求达到max_abandoned个时认为接口不可用，不再发起新请求
+        只更新发生变化的矿工
+        '''
+        _time_start = time.time()
+        fields = ['max_pieceSize', 'min_pieceSize', 'price', 'verified_price']
+        miners = list(Miner.objects.filter().only('id', 'miner_no', *fields))
+
+        def _fetch(miner_no):
+            result_louts = BbheLoutsBase().bill_to_miner_no(miner_no)
+            if result_louts.get("code") != 0:
+                return None
+            data = result_louts.get("data")
+            return dict(max_pieceSize=data.get("max_piece_size", "0"), min_pieceSize=data.get("min_piece_size", "0"),
+                        price=data.get("price", "0"), verified_price=data.get("verified_price", "0"))
+
+        changed = []
+        timeout_count = 0
+        index = 0
+        # 执行中的请求 future -> (矿工, 截止时间)
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=max_workers + max_abandoned)
+        try:
+            while True:
+                while index < len(miners) and len(running) < max_workers and timeout_count < max_abandoned:
+                    running[executor.submit(_fetch, miners[index].miner_no)] = (miners[index], time.time() + timeout)
+                    index += 1
+                if not running:
+                    break
+                next_deadline = min([x[1] for x in running.values()])
+                done, not_done = wait(list(running.keys()), timeout=max(next_deadline - time.time(), 0),
+                                      return_when=FIRST_COMPLETED)
+                now = time.time()
+                for future in list(running.keys()):
+                    miner, deadline = running[future]
+                    if future not in done:
+                        if deadline <= now:
+                            # 超时的请求不再等待，线程不会被取消
+                            timeout_count += 1
+                            running.pop(future)
+                        continue
+                    running.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        logging.warning('获取链上价格失败 %s %s' % (miner.miner_no, e))
+                        continue
+                    if not data or all([str(getattr(miner, k)) == str(v) for k, v in data.items()]):
+                        continue
+                    for k, v in data.items():
+                        setattr(miner, k, v)
+                    changed.append(miner)
+        finally:
+            executor.shutdown(wait=False)
+
+        skip_count = len(miners) - index
+        if skip_count:
+            logging.warning('链上价格接口超时过多，跳过剩余 %s 个矿工' % skip_count)
+        if changed:
+            Miner.objects.bulk_update(changed, fields, batch_size=batch_size)
+        logging.warning('同步链上价格耗时: %s s, 更新 %s, 超时 %s, 跳过 %s' % (
+            time.time() - _time_start, len(changed), timeout_count, skip_count))
+        return format_return(0, data={'success': len(changed), 'timeout': timeout_count, 'skip': skip_count})
 
     def sync_miner_day_stat(self, date=None, miner_no=None):
         '''同步指定日期统计信息'''
@@ -428,38 +1089,187 @@ class MinerBase(object):
             success += 1
         return format_return(0, data={'success': success})
 
-    def sync_miner_total_stat(self, miner_no=None):
-        '''同步累计统计信息'''
+    def sync_miner_total_stat(self, miner_no=None, full=False, chunk_size=500):
+        '''
+        同步累计统计信息
+        以Miner.total_stat_block_id为水位，只累加水位之后写入的区块
+        按写入顺序而不是高度推进，按天补同步的低高度区块也会被计入，已计入区块的修正由add_tipset处理
+        full: 全量重算，用于修复数据
+        '''
+        _time_start = time.time()
+        if miner_no:
+            return self._sync_miner_total_stat_full(miner_nos=[miner_no])
+
+        end_id = TipsetBase().get_max_block_id()
+        start_id = Miner.objects.aggregate(Max('total_stat_block_id'))['total_stat_block_id__max'] or 0
+        if full or not start_id:
+            result = self._sync_miner_total_stat_full()
+            logging.warning('全量同步矿工累计统计耗时: %s s' % (time.time() - _time_start))
+            return result
+        if end_id <= start_id:
+            return format_return(0, data={'success': 0})
+
+        # 新加入的矿工(水位落后)需要单独全量计算
+        sync_time = datetime.datetime.now()
+        fresh_miner_nos = list(Miner.objects.filter(total_stat_block_id__lt=start_id).values_list(
+            'miner_no', flat=True))
+        fresh_set = set(fresh_miner_nos)
+        data = TipsetBase().get_block_tipset_stat(start_id=start_id, end_id=end_id)
+
         success = 0
-        data = TipsetBase().get_date_tipset_stat(miner_no=miner_no)
-        # 优化数据过多很卡 已经快30多秒执行统计
-        for per in data:
-            miner = self.get_miner_by_no(miner_no=per[0])
-            if not miner:
-                continue
-            miner.total_reward = per[1]
-            miner.total_win_count = per[2]
-            miner.total_block_count = per[3]
-            miner.save()
-            success += 1
+        with transaction.atomic():
+            for per in data:
+                if per[0] in fresh_set:
+                    continue
+                success += Miner.objects.filter(miner_no=per[0]).update(
+                    total_reward=F('total_reward') + per[1], total_win_count=F('total_win_count') + per[2],
+                    total_block_count=F('total_block_count') + per[3]
+                )
+            for i in range(0, len(fresh_miner_nos), chunk_size):
+                chunk = fresh_miner_nos[i:i + chunk_size]
+                stat_dict = dict([(x[0], x) for x in TipsetBase().get_block_tipset_stat(
+                    end_id=end_id, miner_nos=chunk)])
+                for fresh_no in chunk:
+                    per = stat_dict.get(fresh_no)
+                    success += Miner.objects.filter(miner_no=fresh_no).update(
+                        total_reward=per[1] if per else 0, total_win_count=per[2] if per else 0,
+                        total_block_count=per[3] if per else 0
+                    )
+            # 只推进本次开始前已存在的矿工，同步期间新增的矿工下次全量计算
+            Miner.objects.filter(create_time__lte=sync_time).update(total_stat_block_id=end_id)
+
+        logging.warning('增量同步矿工累计统计耗时: %s s, 区块id %s -> %s' % (
+            time.time() - _time_start, start_id, end_id))
         return format_return(0, data={'success': success})
 
-    def sync_miner_history(self, date):
-        '''记录历史快照，获取当日活跃矿工，与昨日对比计算增量'''
-        page_index = 0
-        page_size = 100
-        result = BbheBase().get_active_miners(page_index=page_index, page_size=page_size)
-        if not result:
-            return format_return(0)
-
-        while result.get('data', []):
-            for per in result.get('data', []):
-                self.add_miner_history(miner_no=per['miner_no'], date=date)
-            page_index += 1
-            result = BbheBase().get_active_miners(page_index=page_index, page_size=page_size)
+    def _sync_miner_total_stat_full(self, miner_nos=None):
+        '''全量重算矿工累计统计信息'''
+        sync_time = datetime.datetime.now()
+        end_id = TipsetBase().get_max_block_id()
+        data = TipsetBase().get_block_tipset_stat(end_id=end_id, miner_nos=miner_nos)
+        success = 0
+        with transaction.atomic():
+            for per in data:
+                success += Miner.objects.filter(miner_no=per[0]).update(
+                    total_reward=per[1], total_win_count=per[2], total_block_count=per[3]
+                )
+            objs = Miner.objects.filter(create_time__lte=sync_time)
+            if miner_nos:
+                objs = objs.filter(miner_no__in=miner_nos)
+            objs.update(total_stat_block_id=end_id)
+        return format_return(0, data={'success': success})
+
+    def sync_miner_history(self, date, bulk=True, prefetch=2):
+        '''
+        记录历史快照，获取当日活跃矿工，与昨日对比计算增量
+        bulk: 使用全网快照一次性生成，False时逐个矿工生成
+        '''
+        if bulk:
+            self.build_miner_day_snapshot(date=date)
+        else:
+            for data_list in self.get_active_miner_pages(page_size=100, prefetch=prefetch):
+                for per in data_list:
+                    self.add_miner_history(miner_no=per['miner_no'], date=date)
 
+        self.sync_miner_day_cum(date=date)
+        # 排行榜只使用快照完成之后计算的结果
+        MinerSyncLog.objects.update_or_create(date=date, defaults={'history_sync_time': datetime.datetime.now()})
         return format_return(0)
 
+    def _get_last_miner_days(self, record_date, chunk_size=500):
+        '''获取每个矿工在指定日期之前的最后一条记录'''
+        fields = ('miner_no', 'date', 'total_sector', 'power')
+        last_dict = {}
+        # 绝大多数矿工前一天都有记录
+        for obj in MinerDay.objects.filter(date=record_date - datetime.timedelta(days=1)).only(*fields):
+            last_dict.setdefault(obj.miner_no, obj)
+
+        # 其余矿工按最大日期补查
+        missing = list(set(Miner.objects.values_list('miner_no', flat=True)) - set(last_dict.keys()))
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i:i + chunk_size]
+            max_dates = dict(MinerDay.objects.filter(
+                miner_no__in=chunk, date__lt=record_date
+            ).values_list('miner_no').annotate(max_date=Max('date')).order_by())
+            if not max_dates:
+                continue
+            for obj in MinerDay.objects.filter(miner_no__in=list(max_dates.keys()),
+                                               date__in=set(max_dates.values())).only(*fields):
+                if obj.date == max_dates[obj.miner_no]:
+                    last_dict.setdefault(obj.miner_no, obj)
+        return last_dict
+
+    def build_miner_day_snapshot(self, date, batch_size=500):
+        '''
+        一次性生成指定日期全网矿工的历史快照
+        矿工表、上一日记录、当日出块统计、24h状态各查询一次，再批量写入
+        '''
+        _time_start = time.time()
+        now = datetime.datetime.now()
+        record_date = datetime.datetime.strptime(date, '%Y-%m-%d')
+        start_date_str = record_date.strftime('%Y-%m-%d') + ' 00:00:00'
+        end_date_str = (record_date + datetime.timedelta(days=1)).strftime('%Y-%m-%d') + ' 00:00:00'
+        record_date = record_date.date()
+
+        miners = list(Miner.objects.filter())
+        last_dict = self._get_last_miner_days(record_date)
+        block_dict = dict([(x[0], x) for x in TipsetBase().get_date_tipset_stat(
+            start_date=start_date_str, end_date=end_date_str)])
+        stat_dict = dict([(x[0], x) for x in MinerDayStat.objects.values_list('miner_id', 'avg_reward', 'lucky')])
+        exist_dict = {}
+        for obj in MinerDay.objects.filter(date=record_date):
+            exist_dict.setdefault(obj.miner_no, obj)
+
+        new_objs = []
+        update_objs = []
+        for miner in miners:
+            last_record = last_dict.get(miner.miner_no)
+            # 新增扇区
+            new_sector = miner.total_sector
+            if last_record:
+                new_sector = miner.total_sector - last_record.total_sector
+            # 新增算力增量
+            increase_power_offset = 0
+            if last_record:
+                increase_power_offset = miner.power - last_record.power
+
+            obj = exist_dict.get(miner.miner_no)
+            if obj is None:
+                obj = MinerDay(date=record_date, miner_no=miner.miner_no)
+                new_objs.append(obj)
+            else:
+                obj.update_time = now
+                update_objs.append(obj)
+            for field in MINER_DAY_SNAPSHOT_FIELDS:
+                setattr(obj, field, getattr(miner, field))
+            obj.new_sector = new_sector
+            # 新增算力
+            obj.increase_power = new_sector * miner.sector_size
+            obj.increase_power_offset = increase_power_offset
+
+            block = block_dict.get(miner.miner_no)
+            if block:
+                obj.block_reward = block[1]
+                obj.win_count = block[2]
+                obj.block_count = block[3]
+            day_stat = stat_dict.get(miner.id)
+            if day_stat:
+                obj.avg_reward = day_stat[1]
+                obj.lucky = day_stat[2]
+
+        with transaction.atomic():
+            if update_objs:
+                MinerDay.objects.bulk_update(update_objs, MINER_DAY_SNAPSHOT_FIELDS + [
+                    'new_sector', 'increase_power', 'increase_power_offset', 'block_reward', 'win_count',
+                    'block_count', 'avg_reward', 'lucky', 'update_time'
+                ], batch_size=batch_size)
+            if new_objs:
+                MinerDay.objects.bulk_create(new_objs, batch_size=batch_size)
+
+        logging.warning('生成矿工历史快照耗时: %s s, 新增 %s, 更新 %s' % (
+            time.time() - _time_start, len(new_objs), len(update_objs)))
+        return len(new_objs) + len(update_objs)
+
     def add_miner_history(self, miner_no, date=None):
         '''添加矿工历史数据'''
         record_date = datetime.datetime.strptime(date, '%Y-%m-%d')
@@ -530,9 +1340,100 @@ class MinerBase(object):
             obj.lucky = day_stat.lucky
         obj.save()
 
+    def get_miner_day_rows(self, miner_no, start_date=None, end_date=None):
+        '''
+        获取单个矿工[start_date, end_date]的每日记录，按日期倒序
+        优先读列式缓存，缓存不可用时返回MinerDay查询集
+        '''
+        miner_nos = miner_no.split(",") if miner_no else []
+        store = get_miner_day_store() if len(miner_nos) == 1 else None
+        rows = store.get_rows(miner_no, start_date=start_date, end_date=end_date) if store else None
+        if rows is not None:
+            return rows
+        objs = MinerDay.objects.filter(miner_no__in=miner_nos) if len(miner_nos) > 1 else \
+            MinerDay.objects.filter(miner_no=miner_no)
+        if start_date:
+            objs = objs.filter(date__gte=start_date)
+        if end_date:
+            objs = objs.filter(date__lte=end_date)
+        return objs
+
+    def sync_miner_day_columns(self, date=None):
+        '''
+        更新矿工历史列式缓存
+        date: 有变化的最早日期，已有缓存可用时只重新读取这之后的记录，为空时全量重建
+        '''
+        return format_return(0, data=build_miner_day_columns(update_from=date))
+
+    def _get_init_value_from_store(self, store, miner_no, field_list, end_time):
+        '''从列式缓存计算get_init_value，字段没有缓存时返回None'''
+        end_date = datetime.datetime.strptime(str(end_time)[:10], '%Y-%m-%d').date() - datetime.timedelta(days=1)
+        sum_fields = set()
+        for field in field_list:
+            if field == "create_gas":
+                sum_fields.update(['pre_gas', 'prove_gas'])
+            elif field != "initial_pledge_balance":
+                sum_fields.add(field)
+        sums = store.get_sums(miner_no, list(sum_fields), end_date=end_date)
+        if sums is None:
+            return None
+        sums = dict([(k, v if v else 0) for k, v in sums[1].items()])
+
+        result_dict = {}
+        for field in field_list:
+            if field == "create_gas":  # 生产gas
+                result_dict[field] = sums['pre_gas'] + sums['prove_gas']
+            elif field == "initial_pledge_balance":
+                rows = store.get_rows(miner_no, end_date=end_date, fields=[field], limit=1)
+                if rows is None:
+                    return None
+                result_dict[field] = rows[0].initial_pledge_balance if rows else 0
+            else:
+                result_dict[field] = sums[field]
+        return result_dict
+
+    def _get_init_value_from_cum(self, miner_no, field_list, end_time):
+        '''
+        从累计列计算get_init_value，只需要end_time之前最后一条记录
+        字段没有累计列时返回None
+        '''
+        cum_fields = set()
+        for field in field_list:
+            if field == "create_gas":
+                cum_fields.update(['pre_gas', 'prove_gas'])
+            elif field != "initial_pledge_balance":
+                cum_fields.add(field)
+        if not cum_fields.issubset(MINER_DAY_CUM_FIELDS):
+            return None
+        end_date = datetime.datetime.strptime(str(end_time)[:10], '%Y-%m-%d').date() - datetime.timedelta(days=1)
+        count, sums, last = self.get_miner_day_cum_sums(
+            miner_no, list(cum_fields), end_date=end_date, last_fields=['initial_pledge_balance'])
+        if not count:
+            return dict([(field, 0) for field in field_list])
+
+        result_dict = {}
+        for field in field_list:
+            if field == "create_gas":  # 生产gas
+                result_dict[field] = sums['pre_gas'] + sums['prove_gas']
+            elif field == "initial_pledge_balance":
+                result_dict[field] = last['initial_pledge_balance']
+            else:
+                result_dict[field] = sums[field]
+        return result_dict
+
     def get_init_value(self, miner_no, fields, end_time):
-        objs = MinerDay.objects.filter(date__lt=end_time, miner_no=miner_no)
         field_list = fields.split(",")
+        store = get_miner_day_store()
+        if store and end_time:
+            result_dict = self._get_init_value_from_store(store, miner_no, field_list, end_time)
+            if result_dict is not None:
+                return result_dict
+        if end_time and self.is_miner_day_cum_ready():
+            result_dict = self._get_init_value_from_cum(miner_no, field_list, end_time)
+            if result_dict is not None:
+                return result_dict
+
+        objs = MinerDay.objects.filter(date__lt=end_time, miner_no=miner_no)
         result_dict = {}
         for field in field_list:
             if field == "create_gas":  # 生产gas
@@ -550,74 +1451,232 @@ class MinerBase(object):
             result_dict[field] = result
         return result_dict
 
-    def sync_miner_day_gas_2(self, date):
-        '''同步每日汽油费 使用es聚合'''
+    def is_miner_day_cum_ready(self):
+        '''
+        累计列是否可用于查询
+        全量检查(check_miner_day_cum任务)通过或修复后，任务断点记录当时的累计字段，字段一致时可用
+        MINER_DAY_CUM_ENABLED可强制开启，结果在进程内缓存一分钟
+        '''
+        if settings.MINER_DAY_CUM_ENABLED:
+            return True
+        now = time.time()
+        if now - _MINER_DAY_CUM_READY['check_time'] > 60:
+            from job.models import SyncJob
+            checkpoint = SyncJob.objects.filter(name='check_miner_day_cum').values_list('checkpoint', flat=True).first()
+            checkpoint = json.loads(checkpoint or '{}')
+            _MINER_DAY_CUM_READY['ready'] = checkpoint.get('cum_columns') == MINER_DAY_CUM_COLUMNS
+            _MINER_DAY_CUM_READY['check_time'] = now
+        return _MINER_DAY_CUM_READY['ready']
+
+    def get_miner_day_cum_sums(self, miner_no, fields, start_date=None, end_date=None, last_fields=()):
+        '''
+        用累计列计算矿工[start_date, end_date]内各字段的合计
+        只需要两次按(miner_no, date)索引的单点查询，fields必须在MINER_DAY_CUM_FIELDS中
+        返回(记录条数, {字段: 合计}, {last_fields字段: 区间内最后一条记录的值})，区间内没有记录时条数为0
+        '''
+        cum_fields = ['cum_' + x for x in fields] + ['cum_day_count']
+        objs = MinerDay.objects.filter(miner_no=miner_no).order_by('-date', '-create_time')
+        end_objs = objs.filter(date__lte=end_date) if end_date else objs
+        if start_date:
+            end_objs = end_objs.filter(date__gte=start_date)
+        end_record = end_objs.values_list(*(cum_fields + list(last_fields))).first()
+        if not end_record:
+            return 0, dict([(field, 0) for field in fields]), {}
+        start_record = objs.filter(date__lt=start_date).values_list(*cum_fields).first() if start_date else None
+        sums = dict([(field, end_record[i] - (start_record[i] if start_record else 0))
+                     for i, field in enumerate(fields)])
+        count = end_record[len(fields)] - (start_record[len(fields)] if start_record else 0)
+        return count, sums, dict(zip(last_fields, end_record[len(cum_fields):]))
+
+    def _get_last_miner_day_cums(self, miner_nos, record_date):
+        '''获取矿工在指定日期之前最后一条记录的累计值，返回{miner_no: [累计值]}，顺序同MINER_DAY_CUM_COLUMNS'''
+        result = {}
+        # 绝大多数矿工前一天都有记录
+        for record in MinerDay.objects.filter(
+                miner_no__in=miner_nos, date=record_date - datetime.timedelta(days=1)
+        ).values_list('miner_no', *MINER_DAY_CUM_COLUMNS):
+            result.setdefault(record[0], list(record[1:]))
+
+        # 其余矿工按最大日期补查
+        missing = list(set(miner_nos) - set(result.keys()))
+        if not missing:
+            return result
+        max_dates = dict(MinerDay.objects.filter(
+            miner_no__in=missing, date__lt=record_date
+        ).values_list('miner_no').annotate(max_date=Max('date')).order_by())
+        if not max_dates:
+            return result
+        for record in MinerDay.objects.filter(miner_no__in=list(max_dates.keys()), date__in=set(
+                max_dates.values())).values_list('miner_no', 'date', *MINER_DAY_CUM_COLUMNS):
+            if record[1] == max_dates[record[0]]:
+                result.setdefault(record[0], list(record[2:]))
+        return result
+
+    def _sync_miner_day_cum_date(self, record_date, chunk_size=500, batch_size=500):
+        '''按前一条记录的累计值加当天的值，更新指定日期的累计列，返回更新行数'''
+        now = datetime.datetime.now()
+        day_dict = {}
+        objs = MinerDay.objects.filter(date=record_date).only(
+            'id', 'miner_no', *(MINER_DAY_CUM_FIELDS + MINER_DAY_CUM_COLUMNS))
+        for obj in objs:
+            day_dict.setdefault(obj.miner_no, []).append(obj)
+
+        miner_nos = list(day_dict.keys())
+        row_count = 0
+        for i in range(0, len(miner_nos), chunk_size):
+            chunk = miner_nos[i:i + chunk_size]
+            last_dict = self._get_last_miner_day_cums(chunk, record_date)
+            update_objs = []
+            for miner_no in chunk:
+                objs = day_dict[miner_no]
+                last_cums = last_dict.get(miner_no) or [0] * len(MINER_DAY_CUM_COLUMNS)
+                values = [(last_cums[j] or 0) + sum([getattr(x, field) or 0 for x in objs])
+                          for j, field in enumerate(MINER_DAY_CUM_FIELDS)]
+                values.append((last_cums[-1] or 0) + len(objs))
+                # 同一天有多条记录时每条都记录当天结束时的累计值
+                for obj in objs:
+                    if [getattr(obj, x) for x in MINER_DAY_CUM_COLUMNS] == values:
+                        continue
+                    for field, value in zip(MINER_DAY_CUM_COLUMNS, values):
+                        setattr(obj, field, value)
+                    obj.update_time = now
+                    update_objs.append(obj)
+            if update_objs:
+                MinerDay.objects.bulk_update(update_objs, MINER_DAY_CUM_COLUMNS + ['update_time'],
+                                             batch_size=batch_size)
+            row_count += len(update_objs)
+        return row_count
+
+    def sync_miner_day_cum(self, date):
+        '''
+        维护指定日期的累计列，由历史快照、汽油费、过期质押同步后调用
+        之后的日期已经有记录时(补历史数据)，依次向后重算
+        '''
         _time_start = time.time()
+        record_date = datetime.datetime.strptime(str(date)[:10], '%Y-%m-%d').date()
+        dates = [record_date] + list(MinerDay.objects.filter(date__gt=record_date).values_list(
+            'date', flat=True).distinct().order_by('date'))
+        row_count = 0
+        for per_date in dates:
+            row_count += self._sync_miner_day_cum_date(per_date)
+        logging.warning('更新矿工历史累计列耗时: %s s, %s 天, 更新 %s 行' % (
+            time.time() - _time_start, len(dates), row_count))
+        return format_return(0, data=row_count)
+
+    def check_miner_day_cum(self, miner_nos=None, repair=False, chunk_size=200, batch_size=500):
+        '''
+        按每日原始值重新累加，检查累计列是否一致
+        repair为True时写回不一致的记录，返回检查行数、不一致行数和部分不一致的矿工
+        '''
+        _time_start = time.time()
+        field_count = len(MINER_DAY_CUM_FIELDS)
+        if miner_nos is None:
+            miner_nos = MinerDay.objects.values_list('miner_no', flat=True).distinct().order_by()
+        miner_nos = sorted(set(miner_nos))
+
+        check_count = 0
+        mismatch_nos = []
+        mismatch_count = 0
+        for i in range(0, len(miner_nos), chunk_size):
+            records = list(MinerDay.objects.filter(miner_no__in=miner_nos[i:i + chunk_size]).order_by(
+                'miner_no', 'date').values_list('id', 'miner_no', 'date', *(MINER_DAY_CUM_FIELDS + MINER_DAY_CUM_COLUMNS)))
+            check_count += len(records)
+            update_objs = []
+            for miner_no, miner_records in itertools.groupby(records, key=lambda x: x[1]):
+                sums = [0] * (field_count + 1)
+                is_mismatch = False
+                for date, day_records in itertools.groupby(miner_records, key=lambda x: x[2]):
+                    day_records = list(day_records)
+                    for record in day_records:
+                        for j in range(field_count):
+                            sums[j] += record[3 + j] or 0
+                        sums[field_count] += 1
+                    for record in day_records:
+                        if list(record[3 + field_count:]) == sums:
+                            continue
+                        is_mismatch = True
+                        mismatch_count += 1
+                        if repair:
+                            obj = MinerDay(id=record[0], update_time=datetime.datetime.now())
+                            for field, value in zip(MINER_DAY_CUM_COLUMNS, sums):
+                                setattr(obj, field, value)
+                            update_objs.append(obj)
+                if is_mismatch:
+                    mismatch_nos.append(miner_no)
+            if update_objs:
+                MinerDay.objects.bulk_update(update_objs, MINER_DAY_CUM_COLUMNS + ['update_time'],
+                                             batch_size=batch_size)
+
+        logging.warning('检查矿工历史累计列耗时: %s s, 检查 %s 行, 不一致 %s 行' % (
+            time.time() - _time_start, check_count, mismatch_count))
+        return format_return(0, data={
+            'check_count': check_count, 'mismatch_count': mismatch_count, 'mismatch_miner_count': len(mismatch_nos),
+            'mismatch_miner_nos': mismatch_nos[:100], 'repaired': repair
+        })
+
+    def sync_miner_day_gas_2(self, date, batch_size=500):
+        '''
+        同步每日汽油费 使用es聚合
+        单扇区方法(5、6、7)按矿工聚合，每条消息对应一个扇区，次数与逐高度扫描一致
+        批量方法(25、26)需要按扇区计数并加上聚合销毁费，按方法滚动拉取消息后与逐高度扫描同样处理
+        与逐高度扫描(sync_miner_day_gas)的差异: es聚合只有gas合计，单扇区方法的msg_value不计入pledge_gas
+        '''
+        _time_start = time.time()
+        now = datetime.datetime.now()
         # 开始时间戳
         start_date = datetime.datetime.strptime(date, '%Y-%m-%d')
         start_height = int((start_date - self.launch_date).total_seconds() / 30)
         # 结束时间戳 SubmitWindowedPoSt PreCommitSector ProveCommitSector
         end_height = start_height + 2880
 
-        # 统计 SubmitWindowedPoSt
-        # result = BbheEsBase().get_miner_gas_cost_stat_2(
-        #     msg_method_name=['SubmitWindowedPoSt'], start_height=start_height, end_height=end_height
-        # )
-        result = BbheEsBase().get_miner_gas_cost_stat(
-            msg_method=['5'], start_height=start_height, end_height=end_height
-        )
-        for per in result.get('miner_group', {}).get('buckets', []):
-            miner_no = per['key']
-            gas = per['gas_sum']['value']
-            count = per['doc_count']
-
-            obj, created = MinerDay.objects.get_or_create(date=date, miner_no=miner_no)
-            obj.win_post_gas = gas
-            obj.win_post_gas_count = count
-            obj.save()
-
-        # 统计 PreCommitSector
-        # result = BbheEsBase().get_miner_gas_cost_stat_2(
-        #     msg_method_name=['PreCommitSector'], start_height=start_height, end_height=end_height
-        # )
-        result = BbheEsBase().get_miner_gas_cost_stat(
-            msg_method=['6'], start_height=start_height, end_height=end_height
-        )
-        for per in result.get('miner_group', {}).get('buckets', []):
-            miner_no = per['key']
-            gas = per['gas_sum']['value']
-            count = per['doc_count']
-
-            obj, created = MinerDay.objects.get_or_create(date=date, miner_no=miner_no)
-            obj.pre_gas = gas
-            obj.pre_gas_count = count
-            obj.save()
-
-        # 统计 ProveCommitSector
-        # result = BbheEsBase().get_miner_gas_cost_stat_2(
-        #     msg_method_name=['ProveCommitSector'], start_height=start_height, end_height=end_height
-        # )
-        result = BbheEsBase().get_miner_gas_cost_stat(
-            msg_method=['7'], start_height=start_height, end_height=end_height
-        )
-        for per in result.get('miner_group', {}).get('buckets', []):
-            miner_no = per['key']
-            gas = per['gas_sum']['value']
-            count = per['doc_count']
-
-            obj, created = MinerDay.objects.get_or_create(date=date, miner_no=miner_no)
-            obj.prove_gas = gas
-            obj.prove_gas_count = count
-            obj.save()
+        # 单扇区方法对应的字段 SubmitWindowedPoSt PreCommitSector ProveCommitSector
+        method_fields = [('5', 'win_post_gas'), ('6', 'pre_gas'), ('7', 'prove_gas')]
+        gas_dict = {}
+        for msg_method, field in method_fields:
+            result = BbheEsBase().get_miner_gas_cost_stat(
+                msg_method=[msg_method], start_height=start_height, end_height=end_height
+            )
+            for per in result.get('miner_group', {}).get('buckets', []):
+                _add_miner_gas_value(gas_dict, per['key'], field, _d(per['gas_sum']['value']), _d(0),
+                                     per['doc_count'])
+        # PreCommitSectorBatch ProveCommitAggregate
+        for msg_method in ['25', '26']:
+            for hits in iter_method_messages(msg_method, start_height, end_height):
+                add_miner_gas_messages(gas_dict, hits)
+
+        # 先重置当日汽油费，再一次性写入当日所有矿工的汽油费，本次没有数据的矿工不会保留旧值
+        fields = MINER_DAY_GAS_FIELDS
+        exist_dict = {}
+        for obj in MinerDay.objects.filter(date=date, miner_no__in=list(gas_dict.keys())):
+            exist_dict.setdefault(obj.miner_no, obj)
+        new_objs = []
+        for miner_no, gas in gas_dict.items():
+            obj = exist_dict.get(miner_no)
+            if obj is None:
+                obj = MinerDay(date=date, miner_no=miner_no)
+                new_objs.append(obj)
+            obj.update_time = now
+            for field in fields:
+                setattr(obj, field, gas[field])
+        with transaction.atomic():
+            self._reset_miner_day_gas(date=date)
+            if exist_dict:
+                MinerDay.objects.bulk_update(list(exist_dict.values()), fields + ['update_time'],
+                                             batch_size=batch_size)
+            if new_objs:
+                MinerDay.objects.bulk_create(new_objs, batch_size=batch_size)
+        self.sync_miner_day_cum(date=date)
 
         logging.warning('同步汽油费总耗时: %s s' % (time.time() - _time_start))
         return format_return(0)
 
-    def sync_miner_day_gas(self, date, reset=True):
-        '''同步每日汽油费'''
+    def sync_miner_day_gas(self, date, reset=True, search_step=120, prefetch=2):
+        '''
+        同步每日汽油费
+        search_step: 每次从es获取的高度数
+        '''
         _time_start = time.time()
         save_per_count = 200
-        search_step = 5
         sync_obj, created = MinerSyncLog.objects.get_or_create(date=date)
 
         # 开始时间戳
@@ -637,73 +1696,97 @@ class MinerBase(object):
             sync_obj.save()
             temp_index = start_index
             # 重置每日矿工表
-            MinerDay.objects.filter(date=date).update(pre_gas=0, prove_gas=0, win_post_gas=0, pre_gas_count=0,
-                                                      prove_gas_count=0, win_post_gas_count=0)
-
-        def _add_v(d, k, t, v, ps, s_c=1):
-            if k not in d:
-                d[k] = {
-                    'pre_gas': 0, 'prove_gas': 0, 'win_post_gas': 0, 'pledge_gas': 0,
-                    'pre_gas_count': 0, 'prove_gas_count': 0, 'win_post_gas_count': 0
-                }
-            d[k][t] += v
-            d[k]["pledge_gas"] += ps
-            d[k][t + '_count'] += s_c
+            self._reset_miner_day_gas(date=date)
 
         miner_gas_dict = {}
-        while temp_index < end_index:
-            result = BbheEsBase().get_height_messages(
-                heights=[x for x in range(temp_index, temp_index + search_step)])
-            messages = result.get('hits', [])
-            for per in messages:
-                s = per['_source']
-                miner_no = s['msg_to']
-
-                # SubmitWindowedPoSt
-                if s['msg_method'] == 5:
-                    # if s.get('msg_method_name') == 'SubmitWindowedPoSt':
-                    _add_v(miner_gas_dict, miner_no, 'win_post_gas', _d(s['gascost_total_cost']), _d(s['msg_value']))
-                # PreCommitSector PreCommitSectorBatch
-                if s['msg_method'] in [6, 25]:
-                    # if s.get('msg_method_name') == 'PreCommitSector':
-                    pre_agg_gas = _d(0)
-                    sector_count = 1
-                    if s['msg_method'] == 25:  # 多扇区封装
-                        try:
-                            msg_params = json.loads(s.get("msg_params") or "{}")
-                            sector_count = max(len(msg_params.get("Sectors", [])), sector_count)
-                        except:
-                            pass
-                        if s.get('msgrct_exit_code', 0) == 0:
-                            pre_agg_gas = _d(get_aggregate_gas(sector_count, int(s["base_fee2"]),
-                                                               s["height"], s['msg_method']))
-                    _add_v(miner_gas_dict, miner_no, 'pre_gas', _d(s['gascost_total_cost']) + pre_agg_gas,
-                           _d(s['msg_value']), sector_count)
-                # ProveCommitSector ProveCommitAggregate
-                if s['msg_method'] in [7, 26]:
-                    # if s.get('msg_method_name') == 'ProveCommitSector':
-                    prove_agg_gas = _d(0)
-                    sector_count = 1
-                    if s['msg_method'] == 26:  # 多扇区封装
-                        sector_count = max(s.get('sector_count', 0), sector_count)
-                        if s.get('msgrct_exit_code', 0) == 0:
-                            prove_agg_gas = _d(get_aggregate_gas(sector_count, int(s["base_fee2"]),
-                                                                 s["height"], s['msg_method']))
-                    _add_v(miner_gas_dict, miner_no, 'prove_gas', _d(s['gascost_total_cost']) + prove_agg_gas,
-                           _d(s['msg_value']), sector_count)
-
-            temp_index += search_step
-            # 每隔save_per_count次保存一次
-            if temp_index % save_per_count == 0:
+        save_index = temp_index
+        for batch_start, temp_index, hits in iter_height_messages(temp_index, end_index, batch_size=search_step,
+                                                                  prefetch=prefetch):
+            add_miner_gas_messages(miner_gas_dict, hits)
+            # 每隔save_per_count个高度保存一次
+            if temp_index - save_index >= save_per_count:
                 self.save_miner_gas(data=miner_gas_dict, date=date, height=temp_index)
                 miner_gas_dict = {}
+                save_index = temp_index
         # 收尾
         if miner_gas_dict:
             self.save_miner_gas(data=miner_gas_dict, date=date, height=temp_index)
+        self.sync_miner_day_cum(date=date)
 
         logging.warning('同步汽油费总耗时: %s s' % (time.time() - _time_start))
         return format_return(0)
 
+    def sync_miner_day_gas_sharded(self, date, shard_count=12, max_workers=None, search_step=120, reset=False):
+        '''
+        多进程分片同步每日汽油费
+        一天的高度切分为shard_count个分片，每个分片单独记录完成状态
+        某个分片失败后再次调用(reset=False)只会重跑未完成的分片，有分片失败时返回非0的code
+        分片划分以MinerGasShardLog中已有的记录为准，reset=False时shard_count不生效
+        '''
+        _time_start = time.time()
+        start_date = datetime.datetime.strptime(date, '%Y-%m-%d')
+        start_index = int((start_date - self.launch_date).total_seconds() / 30)
+        end_index = int((start_date + datetime.timedelta(days=1) - self.launch_date).total_seconds() / 30)
+        shard_size = int(math.ceil((end_index - start_index) / shard_count))
+
+        if reset:
+            MinerGasShardLog.objects.filter(date=date).delete()
+            self._reset_miner_day_gas(date=date)
+        shard_logs = list(MinerGasShardLog.objects.filter(date=date).order_by('start_height'))
+        if not shard_logs:
+            # 分片划分一次性写入，之后重跑沿用同一划分
+            with transaction.atomic():
+                MinerGasShardLog.objects.bulk_create([
+                    MinerGasShardLog(date=date, start_height=x, end_height=min(x + shard_size, end_index))
+                    for x in range(start_index, end_index, shard_size)
+                ])
+            shard_logs = list(MinerGasShardLog.objects.filter(date=date).order_by('start_height'))
+        # 已有分片必须首尾相接覆盖整天，否则重跑会重复累加汽油费
+        bounds = [start_index] + [x.end_height for x in shard_logs]
+        if [x.start_height for x in shard_logs] != bounds[:-1] or bounds[-1] != end_index:
+            logging.warning('汽油费分片记录不完整 %s，需要reset=True重新同步' % date)
+            return format_return(99904, data={})
+        pending = [x for x in shard_logs if not x.is_finished]
+        if not pending:
+            return format_return(0, data={'finished': len(shard_logs), 'failed': 0})
+
+        # 子进程不能复用父进程的数据库连接
+        connections.close_all()
+        failed = 0
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict([(executor.submit(scan_miner_gas, x.start_height, x.end_height, search_step), x)
+                            for x in pending])
+            for future in as_completed(futures):
+                shard_log = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    failed += 1
+                    logging.warning('汽油费分片同步失败 %s %s-%s %s' % (
+                        date, shard_log.start_height, shard_log.end_height, e))
+                    continue
+                # 分片数据与分片完成状态一起提交
+                with transaction.atomic():
+                    self._add_miner_gas(data=data, date=date)
+                    shard_log.is_finished = True
+                    shard_log.save()
+                logging.warning('保存汽油费分片-->%s %s %s-%s' % (
+                    len(data.keys()), date, shard_log.start_height, shard_log.end_height))
+
+        logging.warning('分片同步汽油费总耗时: %s s, 失败分片 %s' % (time.time() - _time_start, failed))
+        if failed:
+            return format_return(15000, msg='汽油费分片同步失败',
+                                 data={'finished': len(shard_logs) - failed, 'failed': failed})
+        MinerSyncLog.objects.update_or_create(date=date, defaults={'gas_sync_height': end_index})
+        self.sync_miner_day_cum(date=date)
+        return format_return(0, data={'finished': len(shard_logs), 'failed': 0})
+
+    def _reset_miner_day_gas(self, date):
+        '''重置指定日期矿工汽油费'''
+        MinerDay.objects.filter(date=date).update(pre_gas=0, prove_gas=0, win_post_gas=0, pre_gas_count=0,
+                                                  prove_gas_count=0, win_post_gas_count=0, pledge_gas=0,
+                                                  update_time=datetime.datetime.now())
+
     def sync_miner_day_overtime_pledge_fee(self, date):
         result = BbheMngBase().get_ribao_cost(date)
         for miner_info in result.get("data"):
@@ -714,27 +1797,60 @@ class MinerBase(object):
                 miner_obj = miner_objs[0]
                 miner_obj.overtime_pledge_fee = overtime_pledge_fee
                 miner_obj.save()
+        self.sync_miner_day_cum(date=date)
         return format_return(0)
 
     def save_miner_gas(self, data, date, height):
-        '''保存汽油费'''
-        # with transaction.atomic():
-        for miner_no in data:
-            obj, created = MinerDay.objects.get_or_create(date=date, miner_no=miner_no)
-            obj.pre_gas += data[miner_no]['pre_gas']
-            obj.pre_gas_count += data[miner_no]['pre_gas_count']
-            obj.prove_gas += data[miner_no]['prove_gas']
-            obj.prove_gas_count += data[miner_no]['prove_gas_count']
-            obj.win_post_gas += data[miner_no]['win_post_gas']
-            obj.win_post_gas_count += data[miner_no]['win_post_gas_count']
-            obj.pledge_gas += data[miner_no]['pledge_gas']
-            obj.save()
+        '''保存汽油费，与同步进度在同一个事务中提交'''
+        with transaction.atomic():
+            self._add_miner_gas(data=data, date=date)
 
-        sync_obj, created = MinerSyncLog.objects.get_or_create(date=date)
-        sync_obj.gas_sync_height = height
-        sync_obj.save()
+            sync_obj, created = MinerSyncLog.objects.get_or_create(date=date)
+            sync_obj.gas_sync_height = height
+            sync_obj.save()
         logging.warning('保存汽油费-->%s %s %s' % (len(data.keys()), date, height))
 
+    def _add_miner_gas(self, data, date, chunk_size=500):
+        '''
+        将汽油费累加到每日矿工表
+        使用数据库端的自增(col = col + CASE ...)，每批矿工一条UPDATE，避免并发同步时丢失更新
+        缺少的记录用INSERT IGNORE补齐，由(miner_no, date)唯一索引保证并发时不会重复插入
+        '''
+        now = datetime.datetime.now()
+        miner_nos = list(data.keys())
+        for i in range(0, len(miner_nos), chunk_size):
+            chunk = miner_nos[i:i + chunk_size]
+            updates = {}
+            for field in MINER_DAY_GAS_FIELDS:
+                whens = [When(miner_no=x, then=Value(data[x][field])) for x in chunk if data[x][field]]
+                if not whens:
+                    continue
+                output_field = MinerDay._meta.get_field(field)
+                updates[field] = F(field) + Case(*whens, default=Value(0), output_field=output_field)
+
+            with transaction.atomic():
+                MinerDay.objects.bulk_create([MinerDay(date=date, miner_no=x) for x in chunk], ignore_conflicts=True)
+                if updates:
+                    MinerDay.objects.filter(date=date, miner_no__in=chunk).update(update_time=now, **updates)
+
+    def merge_duplicate_miner_days(self):
+        '''
+        删除同一矿工同一天的重复记录，加(miner_no, date)唯一索引之前执行
+        保留默认排序下的第一条(create_time最新，与其他同步读取的一致)
+        重复记录上的汽油费可能被重复累加，返回需要重新同步汽油费的日期
+        '''
+        _time_start = time.time()
+        groups = list(MinerDay.objects.values_list('miner_no', 'date').annotate(
+            count=Count('id')).filter(count__gt=1).order_by())
+        delete_count = 0
+        for miner_no, date, count in groups:
+            ids = list(MinerDay.objects.filter(miner_no=miner_no, date=date).values_list('id', flat=True))
+            delete_count += MinerDay.objects.filter(id__in=ids[1:]).delete()[0]
+        dates = sorted(set([str(x[1]) for x in groups]))
+        logging.warning('合并矿工历史重复记录耗时: %s s, 删除 %s, 涉及日期 %s' % (
+            time.time() - _time_start, delete_count, len(dates)))
+        return format_return(0, data={'delete': delete_count, 'dates': dates})
+
     def get_pool_miner_detail(self, miner_no):
         result_miner = BbheEsBase().get_pool_miner_detail(miner_no)
         result_balance = BbheEsBase().get_pool_miner_wallet_detail(miner_no)
@@ -803,19 +1919,34 @@ class MinerBase(object):
             block_count = 0
             win_count = 0
             lucky = _d(0)
-            objs = MinerDay.objects.filter(date__gte=days, miner_no=miner_no)
-            if not objs:
-                return format_return(0)
-            power = objs[0].power
-            count = 0
-            for obj in objs:
-                count += 1
-                increase_power += obj.increase_power
-                increase_power_offset += obj.increase_power_offset
-                block_reward += obj.block_reward
-                block_count += obj.block_count
-                win_count += obj.win_count
-                lucky += obj.lucky
+            if get_miner_day_store() is None and self.is_miner_day_cum_ready():
+                # 累计列两次单点查询得到区间合计和条数
+                count, sums, last = self.get_miner_day_cum_sums(
+                    miner_no, ['increase_power', 'increase_power_offset', 'block_reward', 'block_count',
+                               'win_count', 'lucky'], start_date=days.date(), last_fields=['power'])
+                if not count:
+                    return format_return(0)
+                power = last['power']
+                increase_power = sums['increase_power']
+                increase_power_offset = sums['increase_power_offset']
+                block_reward = sums['block_reward']
+                block_count = sums['block_count']
+                win_count = sums['win_count']
+                lucky = sums['lucky']
+            else:
+                objs = self.get_miner_day_rows(miner_no, start_date=days)
+                if not objs:
+                    return format_return(0)
+                power = objs[0].power
+                count = 0
+                for obj in objs:
+                    count += 1
+                    increase_power += obj.increase_power
+                    increase_power_offset += obj.increase_power_offset
+                    block_reward += obj.block_reward
+                    block_count += obj.block_count
+                    win_count += obj.win_count
+                    lucky += obj.lucky
             # 计算平均收益
             avg_reward = 0
             if power:
@@ -835,89 +1966,66 @@ class MinerBase(object):
             return _fomoat_data(ds_30)
         return format_return(0)
 
-    def get_miner_line_chart_by_no(self, miner_no, stats_type):
+    def get_miner_line_chart_buckets(self, miner_no, days=30, bucket=1):
+        """
+        按天分桶的算力变化和出块统计，截止到昨天，共days // bucket个桶，按日期正序
+        算力取每个桶最后一天的值，其余字段按桶求和，缺失的日期按0补齐
+        bucket为1时保留每天的原始记录
+        """
+        end_date = datetime.date.today() - datetime.timedelta(days=1)
+        bucket_count = days // bucket
+        grid_days = bucket_count * bucket
+        start_date = end_date - datetime.timedelta(days=grid_days - 1)
+
+        # 对齐到日期网格，下标为距start_date的天数
+        fields = ["power", "increase_power_offset", "block_reward", "block_count"]
+        grid = dict([(field, np.full(grid_days, 0 if bucket == 1 or field == "block_count" else _d(0),
+                                     dtype=object)) for field in fields])
+        exists = np.zeros(grid_days, dtype=bool)
+        for obj in self.get_miner_day_rows(miner_no, start_date=start_date, end_date=end_date):
+            # 同一天有多条记录时以最后一条为准
+            i = (obj.date - start_date).days
+            exists[i] = True
+            for field in fields:
+                grid[field][i] = getattr(obj, field)
+
+        ends = [start_date + datetime.timedelta(days=bucket * (x + 1) - 1) for x in range(bucket_count)]
+        if bucket == 1:
+            return [dict([(field, grid[field][i]) for field in fields] + [("date", ends[i].strftime('%Y-%m-%d'))])
+                    for i in range(bucket_count)]
+
+        # 算力取桶内最后一天，桶内其他字段求和
+        power = np.where(exists, grid["power"], 0).reshape(bucket_count, bucket)[:, -1]
+        sums = dict([(field, grid[field].reshape(bucket_count, bucket).sum(axis=1)) for field in fields[1:]])
+        return [{
+            "power": power[i],
+            "increase_power_offset": sums["increase_power_offset"][i],
+            "block_reward": sums["block_reward"][i],
+            "block_count": sums["block_count"][i],
+            "date": ends[i].strftime('%Y-%m-%d')
+        } for i in range(bucket_count)]
+
+    def get_miner_line_chart_by_no(self, miner_no, stats_type, bucket=None):
         """
         矿工的算力变化和出块统计
+        stats_type: 24h或Nd(30d、90d、180d、365d...)，按天统计时默认分成30个桶
         """
-        now_date = datetime.datetime.today()
-        if stats_type == "30d":
-            ds_30 = now_date - datetime.timedelta(days=30)
-            ds_30_list = [ds_30 + datetime.timedelta(days=1 * x) for x in range(0, 30)]
-            objs = MinerDay.objects.filter(date__gte=ds_30, miner_no=miner_no)
-            ds_30_dict = {}
-            for obj in objs:
-                ds_30_dict[obj.date.strftime('%Y-%m-%d')] = {
-                    "power": obj.power,
-                    "increase_power_offset": obj.increase_power_offset,
-                    "block_reward": obj.block_reward,
-                    "block_count": obj.block_count,
-                    "date": obj.date.strftime('%Y-%m-%d')
-                }
-            ds_30_result = []
-            for day1 in ds_30_list:
-                ds_30_result.append(ds_30_dict.get(day1.strftime('%Y-%m-%d'), {
-                    "power": 0,
-                    "increase_power_offset": 0,
-                    "block_reward": 0,
-                    "block_count": 0,
-                    "date": day1.strftime('%Y-%m-%d')
-                }))
-            return ds_30_result
-
-        if stats_type == "180d":
-            ds_180 = now_date - datetime.timedelta(days=180)
-            ds_180_list = [now_date - datetime.timedelta(days=6 * x + 1) for x in range(0, 30)]
-            objs = MinerDay.objects.filter(date__gte=ds_180, miner_no=miner_no)
-            ds_180_dict = {}
-            for obj in objs:
-                ds_180_dict[obj.date.strftime('%Y-%m-%d')] = {
-                    "power": obj.power,
-                    "increase_power_offset": obj.increase_power_offset,
-                    "block_reward": obj.block_reward,
-                    "block_count": obj.block_count,
-                    "date": obj.date.strftime('%Y-%m-%d')
-                }
-            ds_180_list.reverse()
-            ds_180_result = []
-            for i, day6 in enumerate(ds_180_list):
-                power = ds_180_dict.get(day6.strftime('%Y-%m-%d'), {}).get('power', 0)
-                increase_power_offset = _d(0)
-                block_reward = _d(0)
-                block_count = 0
-                for day1 in [day6 - datetime.timedelta(days=x) for x in range(0, 6)]:
-                    day_ = day1.strftime('%Y-%m-%d')
-                    increase_power_offset += ds_180_dict.get(day_, {}).get('increase_power_offset', _d(0))
-                    block_reward += ds_180_dict.get(day_, {}).get('block_reward', _d(0))
-                    block_count += ds_180_dict.get(day_, {}).get('block_count', 0)
-                ds_180_result.append({
-                    "power": power,
-                    "increase_power_offset": increase_power_offset,
-                    "block_reward": block_reward,
-                    "block_count": block_count,
-                    "date": day6.strftime('%Y-%m-%d')
-                })
-            return ds_180_result
+        if stats_type and stats_type.endswith("d") and stats_type[:-1].isdigit() and int(stats_type[:-1]) > 0:
+            days = int(stats_type[:-1])
+            bucket = min(max(bucket or days // 30, 1), days)
+            return self.get_miner_line_chart_buckets(miner_no, days=days, bucket=bucket)
 
         if stats_type == "24h":
             hs_24 = datetime.datetime.now() - datetime.timedelta(days=1)
             hs_24_list = [(hs_24 + datetime.timedelta(hours=1 * x)).replace(minute=0, second=0, microsecond=0) for x in
                           range(0, 24)]
 
-            condition = "WHERE miner_no = '%s' AND record_time >= '%s'" % (miner_no,
-                                                                           hs_24_list[0].strftime('%Y-%m-%d %H'))
-            sql = """
-                SELECT sum(reward), DATE_FORMAT(record_time ,'%Y-%m-%d %H'),count(*)
-                FROM tipset_temptipsetblock
-                """ + condition + """
-                GROUP BY  DATE_FORMAT(record_time ,'%Y-%m-%d %H')
-            """
-            objs = raw_sql.exec_sql(sql)
             hs_24_dict = {}
-            for obj in objs:
-                hs_24_dict[obj[1]] = {
-                    "block_reward": obj[0],
-                    "block_count": obj[2],
-                    "date": obj[1] + ":00:00"
+            for obj in TipsetBase().get_miner_hour_stats(miner_no, hs_24_list[0]):
+                hs_24_dict[obj.hour.strftime('%Y-%m-%d %H')] = {
+                    "block_reward": obj.reward,
+                    "block_count": obj.block_count,
+                    "date": obj.hour.strftime('%Y-%m-%d %H:%M:%S')
                 }
             hs_24_result = []
             for hs1 in hs_24_list:
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from miner.interface import MinerBase
+from job.interface import JobBase
+
+
+class Command(BaseCommand):
+    help = '''
+    删除矿工历史表中同一矿工同一天的重复记录，给MinerDay加(miner_no, date)唯一索引的迁移前执行
+    涉及的日期提交分片汽油费任务(reset)重新同步，同步完成后重算累计列
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-resync', action='store_true', help='不重新同步涉及日期的汽油费')
+
+    def handle(self, *args, **options):
+        result = MinerBase().merge_duplicate_miner_days()
+        self.stdout.write('删除重复记录 %(delete)s 条，涉及日期 %(dates)s' % result['data'])
+        if options['no_resync']:
+            return
+        for date in result['data']['dates']:
+            JobBase().enqueue('sync_miner_day_gas', params={'date': date, 'sharded': True, 'reset': True})
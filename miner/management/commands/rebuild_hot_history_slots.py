@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from miner.models import MinerHotHistory
+from miner.interface import MinerBase
+
+
+class Command(BaseCommand):
+    help = '''
+    整理热表数据，给MinerHotHistory加(miner_no, slot)唯一索引的迁移前后执行
+    还没有slot列时清空热表(只保存48小时数据)，已有slot列时按record_time回填槽位并删除重复记录
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--truncate', action='store_true', help='直接清空热表')
+
+    def handle(self, *args, **options):
+        table = MinerHotHistory._meta.db_table
+        with connection.cursor() as cursor:
+            if table not in connection.introspection.table_names(cursor):
+                self.stdout.write('热表 %s 不存在，无需处理' % table)
+                return
+            columns = [x.name for x in connection.introspection.get_table_description(cursor, table)]
+            # 没有slot列时无法回填
+            if options['truncate'] or 'slot' not in columns:
+                cursor.execute('TRUNCATE TABLE %s' % connection.ops.quote_name(table))
+                self.stdout.write('已清空热表 %s' % table)
+                return
+
+        result = MinerBase().rebuild_hot_history_slots()
+        self.stdout.write('回填热表槽位完成，删除 %(delete)s，更新 %(update)s' % result['data'])
@@ -23,6 +23,7 @@ class Miner(models.Model):
     total_reward = models.DecimalField('累计出块奖励', max_digits=34, decimal_places=0, default=0)
     total_block_count = models.IntegerField('累计出块数量', default=0)
     total_win_count = models.IntegerField('累计赢票数量', default=0)
+    total_stat_block_id = models.BigIntegerField('累计统计到的区块id', default=0)
     ip = models.CharField('ip', max_length=128, null=True)
     peer_id = models.CharField('peer_id', max_length=128, null=True)
     worker = models.CharField('worker', max_length=128, null=True)
@@ -36,12 +37,16 @@ class Miner(models.Model):
     poster_address = models.CharField('poster地址', max_length=128, null=True)
     account_type = models.CharField('账户类型', max_length=128, null=True)
     ranking = models.IntegerField('排名', default=0)
+    sector_ranking = models.IntegerField('同扇区类型排名', default=0)
     is_pool = models.IntegerField('是否矿池的矿工', default=0)
     # 链上数据展示
     max_pieceSize = models.CharField('max_pieceSize', max_length=64, default="0")
     min_pieceSize = models.CharField('min_pieceSize', max_length=64, default="0")
     price = models.CharField('price', max_length=32, default="0")
     verified_price = models.CharField('verified_price', max_length=32, default="0")
+    # 加入时间回填
+    join_time_fail_count = models.IntegerField('加入时间同步失败次数', default=0)
+    join_time_sync_time = models.DateTimeField('加入时间最近同步时间', null=True)
 
     create_time = models.DateTimeField('创建时间', auto_now_add=True)
     update_time = models.DateTimeField('更新时间', auto_now=True)
@@ -51,10 +56,15 @@ class Miner(models.Model):
 
 
 class MinerHotHistory(models.Model):
-    '''矿工热表，只保留48小时数据'''
+    '''
+    矿工热表，只保留48小时数据
+    每个矿工固定96个槽位(30分钟一个)，按槽位原地覆盖，不再删除历史记录
+    加唯一索引前后执行 manage.py rebuild_hot_history_slots 整理旧数据
+    '''
     id = models.BigAutoField(primary_key=True)
     miner_no = models.CharField('矿工no', max_length=128, db_index=True)
-    record_time = models.DateTimeField('记录时间')
+    slot = models.IntegerField('环形槽位', default=0)
+    record_time = models.DateTimeField('记录时间', db_index=True)
     raw_power = models.DecimalField('原值算力', max_digits=34, decimal_places=0, default=0)
     power = models.DecimalField('有效算力', max_digits=34, decimal_places=0, default=0)
     total_sector = models.IntegerField('总的扇区数', default=0)
@@ -68,6 +78,23 @@ class MinerHotHistory(models.Model):
 
     class Meta:
         ordering = ["-record_time", ]
+        unique_together = ("miner_no", "slot")
+
+
+class MinerAddress(models.Model):
+    '''
+    地址反查索引，同步有效矿工时按矿工增量维护
+    role为地址在矿工表中的字段名(miner_no、owner、worker_address等)
+    '''
+    address = models.CharField('地址', max_length=128, db_index=True)
+    miner_no = models.CharField('矿工no', max_length=128, db_index=True)
+    role = models.CharField('地址类型', max_length=32)
+
+    create_time = models.DateTimeField('创建时间', auto_now_add=True)
+    update_time = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        unique_together = ("miner_no", "role")
 
 
 class MinerDayStat(models.Model):
@@ -132,18 +159,57 @@ class MinerDay(models.Model):
     poster_balance = models.DecimalField('poster余额', max_digits=34, decimal_places=0, default=0)
     poster_address = models.CharField('poster地址', max_length=128, null=True, db_index=True)
     overtime_pledge_fee = models.DecimalField('过期质押', max_digits=34, decimal_places=0, default=0)
+    # 累计列: 该矿工截止当天(含)所有记录的合计，区间合计为两条记录之差
+    cum_pre_gas = models.DecimalField('累计pre_gas费', max_digits=40, decimal_places=0, default=0)
+    cum_prove_gas = models.DecimalField('累计prove_gas', max_digits=40, decimal_places=0, default=0)
+    cum_win_post_gas = models.DecimalField('累计win_post_gas费', max_digits=40, decimal_places=0, default=0)
+    cum_pledge_gas = models.DecimalField('累计质押gas', max_digits=40, decimal_places=0, default=0)
+    cum_overtime_pledge_fee = models.DecimalField('累计过期质押', max_digits=40, decimal_places=0, default=0)
+    cum_block_reward = models.DecimalField('累计出块奖励', max_digits=40, decimal_places=0, default=0)
+    cum_block_count = models.IntegerField('累计出块数量', default=0)
+    cum_win_count = models.IntegerField('累计赢票数量', default=0)
+    cum_increase_power = models.DecimalField('累计新增算力', max_digits=40, decimal_places=0, default=0)
+    cum_increase_power_offset = models.DecimalField('累计新增算力差值', max_digits=40, decimal_places=0, default=0)
+    cum_lucky = models.DecimalField('累计幸运值', max_digits=20, decimal_places=4, default=0)
+    cum_day_count = models.IntegerField('累计记录条数', default=0)
 
     create_time = models.DateTimeField('创建时间', auto_now_add=True)
-    update_time = models.DateTimeField('更新时间', auto_now=True)
+    # 列式缓存按update_time判断是否有记录变化，批量更新时需要手动设置
+    update_time = models.DateTimeField('更新时间', auto_now=True, db_index=True)
 
     class Meta:
         ordering = ["-date", "-create_time", ]
+        # 并发同步时靠唯一索引避免重复记录，加索引前执行 manage.py merge_duplicate_miner_days
+        unique_together = ("miner_no", "date")
+
+
+class MinerLeaderboard(models.Model):
+    '''
+    多日排行榜，每晚按标准时间窗口预先计算
+    value1~value3对应get_miner_day_ranking_list各filter_type的统计值
+    '''
+    id = models.BigAutoField(primary_key=True)
+    start_date = models.DateField('开始日期')
+    end_date = models.DateField('结束日期', db_index=True)
+    sector_type = models.IntegerField('扇区类型(-1全部)', default=-1)
+    filter_type = models.CharField('排序类型', max_length=32)
+    rank = models.IntegerField('排名', default=0)
+    miner_no = models.CharField('矿工no', max_length=128)
+    value1 = models.DecimalField('统计值1', max_digits=40, decimal_places=8, default=0)
+    value2 = models.DecimalField('统计值2', max_digits=40, decimal_places=8, default=0)
+    value3 = models.DecimalField('统计值3', max_digits=40, decimal_places=8, default=0)
+    create_time = models.DateTimeField('创建时间', auto_now_add=True)
+
+    class Meta:
+        ordering = ["rank", ]
+        indexes = [models.Index(fields=["end_date", "start_date", "filter_type", "sector_type", "rank"])]
 
 
 class MinerSyncLog(models.Model):
     '''同步日志'''
     date = models.DateField('时间', db_index=True)
     gas_sync_height = models.IntegerField('gas费同步到的高度', default=0)
+    history_sync_time = models.DateTimeField('历史快照完成时间', null=True)
     create_time = models.DateTimeField('创建时间', auto_now_add=True)
     update_time = models.DateTimeField('更新时间', auto_now=True)
 
@@ -151,6 +217,19 @@ class MinerSyncLog(models.Model):
         ordering = ["-date", "-create_time", ]
 
 
+class MinerGasShardLog(models.Model):
+    '''汽油费分片同步日志'''
+    date = models.DateField('时间', db_index=True)
+    start_height = models.IntegerField('分片开始高度', default=0)
+    end_height = models.IntegerField('分片结束高度', default=0)
+    is_finished = models.BooleanField('是否完成', default=False)
+    create_time = models.DateTimeField('创建时间', auto_now_add=True)
+    update_time = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        ordering = ["-date", "start_height", ]
+
+
 class Company(models.Model):
     '''矿商'''
     code = models.CharField('矿商code', max_length=128)
@@ -1,10 +1,18 @@
+import os
 import json
+import decimal
+import datetime
 
+from django.db.models import Sum
 from django.test import TestCase
 from django.test.client import Client
 
 from explorer_s_common.utils import format_return, format_price, format_power
 
+from miner.models import MinerDay
+from miner.interface import MinerBase
+from miner.columnar import build_miner_day_columns, MinerDayColumnStore, _split_decimal, _is_store_changed
+
 
 class minerTestCase(TestCase):
 
@@ -17,3 +25,125 @@ class minerTestCase(TestCase):
             '/activity/api/dashboard/get_overview', {}
         ).json()
         print(result)
+
+
+class minerDayColumnsTestCase(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.column_dir = os.path.join(tempfile.mkdtemp(), 'miner_day_columns')
+        self.start_date = datetime.date(2021, 6, 1)
+        # 大部分小数字段为0，另有负数和超过int64的最小单位值
+        for i in range(5):
+            MinerDay.objects.create(
+                miner_no='f01000', date=self.start_date + datetime.timedelta(days=i), power=i * 1024 ** 5,
+                pre_gas=0, block_reward=decimal.Decimal(10 ** 20) if i % 2 else 0, block_count=i,
+                lucky=decimal.Decimal('0.0000'), avg_reward=decimal.Decimal('-0.1234') if i == 3 else 0
+            )
+        MinerDay.objects.create(miner_no='f02000', date=self.start_date + datetime.timedelta(days=2))
+
+    def test_split_decimal_zero_and_null(self):
+        self.assertEqual(_split_decimal(None, 4), (0, 0))
+        self.assertEqual(_split_decimal(decimal.Decimal('0'), 4), (0, 0))
+        self.assertEqual(_split_decimal(decimal.Decimal('0.0000'), 0), (0, 0))
+
+    def _assert_store_matches_orm(self, store):
+        fields = ['power', 'pre_gas', 'block_reward', 'block_count', 'lucky', 'avg_reward']
+        for miner_no in ['f01000', 'f02000']:
+            objs = MinerDay.objects.filter(miner_no=miner_no)
+            rows = store.get_rows(miner_no, fields=fields)
+            self.assertEqual([x.date for x in rows], [x.date for x in objs.order_by('-date')])
+            for row, obj in zip(rows, objs.order_by('-date')):
+                for field in fields:
+                    self.assertEqual(getattr(row, field), getattr(obj, field))
+            count, sums = store.get_sums(miner_no, fields)
+            self.assertEqual(count, objs.count())
+            orm_sums = objs.aggregate(**dict([(x, Sum(x)) for x in fields]))
+            for field in fields:
+                self.assertEqual(sums[field], orm_sums[field] or 0)
+
+    def test_build_and_update(self):
+        self.assertEqual(build_miner_day_columns(column_dir=self.column_dir), 6)
+        self._assert_store_matches_orm(MinerDayColumnStore(self.column_dir))
+
+        # 增量更新只读取变化日期之后的记录
+        update_date = self.start_date + datetime.timedelta(days=5)
+        MinerDay.objects.filter(miner_no='f01000', date=self.start_date + datetime.timedelta(days=4)).update(
+            pre_gas=decimal.Decimal(123))
+        MinerDay.objects.create(miner_no='f01000', date=update_date, pre_gas=decimal.Decimal(456))
+        MinerDay.objects.create(miner_no='f03000', date=update_date)
+        count = build_miner_day_columns(column_dir=self.column_dir,
+                                        update_from=self.start_date + datetime.timedelta(days=4))
+        self.assertEqual(count, 3)
+        store = MinerDayColumnStore(self.column_dir)
+        self.assertEqual(store.miner_nos, ['f01000', 'f02000', 'f03000'])
+        self.assertEqual(store.end_date, update_date)
+        self._assert_store_matches_orm(store)
+
+    def test_changed_rows_invalidate_store(self):
+        build_miner_day_columns(column_dir=self.column_dir)
+        self.assertFalse(_is_store_changed(MinerDayColumnStore(self.column_dir)))
+
+        # 回写已缓存日期的汽油费后缓存失效，增量重建时从变化的日期开始读取
+        MinerDay.objects.filter(miner_no='f01000', date=self.start_date + datetime.timedelta(days=1)).update(
+            pre_gas=decimal.Decimal(789), update_time=datetime.datetime.now())
+        self.assertTrue(_is_store_changed(MinerDayColumnStore(self.column_dir)))
+        build_miner_day_columns(column_dir=self.column_dir, update_from=self.start_date + datetime.timedelta(days=4))
+        store = MinerDayColumnStore(self.column_dir)
+        self.assertFalse(_is_store_changed(store))
+        self._assert_store_matches_orm(store)
+
+
+class minerDayCumTestCase(TestCase):
+
+    def setUp(self):
+        self.start_date = datetime.date(2021, 6, 1)
+        # f02000缺少中间几天的记录，需要按最大日期补查
+        for i in range(5):
+            MinerDay.objects.create(
+                miner_no='f01000', date=self.start_date + datetime.timedelta(days=i), power=i,
+                increase_power=i * 10, block_reward=decimal.Decimal(10 ** 20), block_count=i,
+                lucky=decimal.Decimal('0.5000')
+            )
+        for i in [0, 4]:
+            MinerDay.objects.create(miner_no='f02000', date=self.start_date + datetime.timedelta(days=i),
+                                    block_count=1)
+
+    def test_sync_and_sums(self):
+        for i in range(5):
+            MinerBase().sync_miner_day_cum(date=str(self.start_date + datetime.timedelta(days=i)))
+        result = MinerBase().check_miner_day_cum()
+        self.assertEqual(result['data']['mismatch_count'], 0)
+
+        start_date = self.start_date + datetime.timedelta(days=1)
+        end_date = self.start_date + datetime.timedelta(days=3)
+        fields = ['increase_power', 'block_reward', 'block_count', 'lucky']
+        for miner_no in ['f01000', 'f02000']:
+            objs = MinerDay.objects.filter(miner_no=miner_no, date__gte=start_date, date__lte=end_date)
+            count, sums, last = MinerBase().get_miner_day_cum_sums(
+                miner_no, fields, start_date=start_date, end_date=end_date, last_fields=['power'])
+            self.assertEqual(count, objs.count())
+            if not count:
+                continue
+            orm_sums = objs.aggregate(**dict([(x, Sum(x)) for x in fields]))
+            for field in fields:
+                self.assertEqual(sums[field], orm_sums[field])
+            self.assertEqual(last['power'], objs.order_by('-date').first().power)
+
+
+class minerDayGasTestCase(TestCase):
+
+    def test_add_miner_gas(self):
+        date = datetime.date(2021, 6, 1)
+        MinerDay.objects.create(miner_no='f01000', date=date, pre_gas=decimal.Decimal(5))
+        gas = dict([(x, 0) for x in ['pre_gas', 'pre_gas_count', 'prove_gas', 'prove_gas_count', 'win_post_gas',
+                                    'win_post_gas_count', 'pledge_gas']])
+        data = {'f01000': dict(gas, pre_gas=decimal.Decimal(10), pre_gas_count=1),
+                'f02000': dict(gas, prove_gas=decimal.Decimal(7), prove_gas_count=2)}
+        for i in range(2):
+            MinerBase()._add_miner_gas(data=data, date=date)
+        self.assertEqual(MinerDay.objects.filter(date=date).count(), 2)
+        obj = MinerDay.objects.get(miner_no='f01000', date=date)
+        self.assertEqual((obj.pre_gas, obj.pre_gas_count), (25, 2))
+        obj = MinerDay.objects.get(miner_no='f02000', date=date)
+        self.assertEqual((obj.prove_gas, obj.prove_gas_count), (14, 4))
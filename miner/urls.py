@@ -15,7 +15,7 @@ urlpatterns = [
     url(r'^get_miner_day_records$', views.get_miner_day_records),
     url(r'^get_miner_increment$', views.get_miner_increment),  # 获得矿工所有数据的增量
     url(r'^get_miner_mining_stats_by_no$', views.get_miner_mining_stats_by_no),  # 获取每个矿工产出统计7/30
-    url(r'^get_miner_line_chart_by_no$', views.get_miner_line_chart_by_no),  # 矿工的算力变化和出块统计24/30/180
+    url(r'^get_miner_line_chart_by_no$', views.get_miner_line_chart_by_no),  # 矿工的算力变化和出块统计24h/30d/90d/180d/365d
     url(r'^get_148888_active_miners$', views.get_148888_active_miners),
     # 节点健康报告
     url(r'^get_miner_health_report_24h_by_no', views.get_miner_health_report_24h_by_no),
@@ -33,13 +33,17 @@ urlpatterns = [
     url(r'^get_init_value$', views.get_init_value),  # 获得初始数据
 
     url(r'^sync_active_miners$', views.sync_active_miners),
+    url(r'^sync_miner_join_time$', views.sync_miner_join_time),  # 回填矿工加入时间
+    url(r'^rebuild_miner_address$', views.rebuild_miner_address),  # 重建地址反查索引
     # url(r'^sync_pool_miners$', views.sync_pool_miners),
     url(r'^sync_miner_total_stat$', views.sync_miner_total_stat),
     # url(r'^sync_miner_day_stat$', views.sync_miner_day_stat),
     # url(r'^sync_miner_temp_stat$', views.sync_miner_temp_stat),
     url(r'^sync_miner_history$', views.sync_miner_history),
+    url(r'^sync_miner_leaderboard$', views.sync_miner_leaderboard),  # 计算多日排行榜
     url(r'^sync_miner_day_gas$', views.sync_miner_day_gas),
     url(r'^sync_miner_day_overtime_pledge_fee$', views.sync_miner_day_overtime_pledge_fee),  # 同步每日浪费质押gas
+    url(r'^check_miner_day_cum$', views.check_miner_day_cum),  # 检查/修复历史累计列
     url(r'^sync_miner_lotus$', views.sync_miner_lotus),  # 同步链上的数据
 
 ]
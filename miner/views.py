@@ -6,19 +6,31 @@ from explorer_s_common.decorator import common_ajax_response
 from explorer_s_common.utils import format_return, format_price, format_power, format_fil_to_decimal, format_fil, \
     format_power_to_TiB, _d
 from explorer_s_common.page import Page
+from explorer_s_data.utils import cursor_page
 from miner.interface import MinerBase
+from miner.models import MinerDayStat
 from tipset.interface import TipsetBase
 from overview.interface import OverviewBase
+from job.interface import JobBase
 
 
 def format_miner(objs):
     if objs is None:
         return None
 
+    miners = list(objs) if isinstance(objs, Iterable) else [objs]
+    # 整页一次性查询昨日记录、全网数据、24小时状态与排名
+    date = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    miner_day_dict = {}
+    for record in MinerBase().get_miner_day_records(date=date).filter(miner_no__in=[x.miner_no for x in miners]):
+        miner_day_dict.setdefault(record.miner_no, record)
+    overview_day = OverviewBase().get_overview_one_day_records(date)
+    stat_dict = dict([(x.miner_id, x) for x in MinerDayStat.objects.filter(miner_id__in=[x.id for x in miners])])
+    ranking_dict = MinerBase().get_miner_rankings(miners)
+
     def _format_obj(obj):
-        stat = obj.miner_day_stat
-        date = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-        objs = MinerBase().get_miner_day_records(miner_no=obj.miner_no, date=date)
+        stat = stat_dict[obj.id] if obj.id in stat_dict else obj.miner_day_stat
+        record = miner_day_dict.get(obj.miner_no)
         increase_power = 0
         increase_power_offset = 0
         is_32 = True if obj.sector_size == 34359738368 else False  # 是否是32扇区
@@ -26,15 +38,14 @@ def format_miner(objs):
         create_gas = 0
         pledge_gas = 0
         overview_day_create_gas = 0  # 全网昨日生成值
-        overview_day = OverviewBase().get_overview_one_day_records(date)
         if overview_day:
             overview_day_create_gas = overview_day.create_gas_32 if is_32 else overview_day.create_gas_64
-        if objs:
-            increase_power = objs[0].increase_power
-            increase_power_offset = objs[0].increase_power_offset
-            pledge_gas = objs[0].pledge_gas
-            create_total_gas = objs[0].pre_gas + objs[0].prove_gas + objs[0].overtime_pledge_fee
-            total_gas = create_total_gas + objs[0].win_post_gas
+        if record:
+            increase_power = record.increase_power
+            increase_power_offset = record.increase_power_offset
+            pledge_gas = record.pledge_gas
+            create_total_gas = record.pre_gas + record.prove_gas + record.overtime_pledge_fee
+            total_gas = create_total_gas + record.win_post_gas
             create_gas = (create_total_gas / (increase_power / _d(math.pow(1024, 4)))) if increase_power else 0
         gas_offset = format_fil_to_decimal(create_gas, 4) - format_fil_to_decimal(overview_day_create_gas, 4)
         return {
@@ -49,7 +60,7 @@ def format_miner(objs):
             'locked_pledge_balance': obj.locked_pledge_balance, 'total_reward': obj.total_reward,
             'total_block_count': obj.total_block_count, 'total_win_count': obj.total_win_count,
             'ip': obj.ip, 'peer_id': obj.peer_id, 'worker': obj.worker,
-            'owner': obj.owner, 'ranking': MinerBase().get_miner_ranking(miner_no=obj.miner_no),
+            'owner': obj.owner, 'ranking': ranking_dict[obj.miner_no],
             'is_pool': obj.is_pool, 'avg_reward': stat.avg_reward, 'lucky': stat.lucky,
             'block_reward': stat.block_reward, 'block_count': stat.block_count, 'win_count': stat.win_count,
             'increase_power_24': stat.increase_power, 'increase_power_offset_24': stat.increase_power_offset,
@@ -64,7 +75,7 @@ def format_miner(objs):
             'day_overview_create_gas': format_fil(overview_day_create_gas), 'day_gas_offset': gas_offset,
         }
 
-    return [_format_obj(obj) for obj in objs] if isinstance(objs, Iterable) else _format_obj(objs)
+    return [_format_obj(obj) for obj in miners] if isinstance(objs, Iterable) else _format_obj(objs)
 
 
 def format_miner_day(objs):
@@ -134,12 +145,20 @@ def get_miner_list_by_power_inc(request):
     end_date = request.POST.get('end_date')
     sector_type = request.POST.get('sector_type')
     miner_no_list = json.loads(request.POST.get('miner_no_list', '[]'))
+    leaderboard = None
     if miner_no_list:
         objs = MinerBase().get_miner_day_ranking_list(start_date, end_date, sector_type=sector_type, miner_no_list= miner_no_list)
     else:
-        clkey = "{0}_{1}_{2}".format(start_date, end_date, "increase_power")
-        objs = MinerBase().get_miner_day_ranking_list_cache(clkey, start_date, end_date, filter_type="increase_power")
-    data = Page(objs, page_size).page(page_index)
+        # 标准时间窗口直接读预先计算的排行榜
+        leaderboard = MinerBase().get_miner_leaderboard(start_date, end_date, sector_type=sector_type,
+                                                        filter_type="increase_power")
+        clkey = "{0}_{1}_{2}_{3}".format(start_date, end_date, "increase_power", sector_type)
+        objs = leaderboard if leaderboard is not None else MinerBase().get_miner_day_ranking_list_cache(
+            clkey, start_date, end_date, sector_type=sector_type, filter_type="increase_power")
+    if leaderboard is not None:
+        data = MinerBase().get_miner_leaderboard_page(leaderboard, page_index, page_size, filter_type="increase_power")
+    else:
+        data = Page(objs, page_size).page(page_index)
     miner_list = MinerBase().get_miner_list(miner_no_list=[miner_day[0] for miner_day in data['objects']]).all()
     miner_no_dict = {}
     for miner in miner_list:
@@ -182,14 +201,22 @@ def get_miner_list_by_avg_reward(request):
     end_date = request.POST.get('end_date')
     sector_type = request.POST.get('sector_type')
     miner_no_list = json.loads(request.POST.get('miner_no_list', '[]'))
+    leaderboard = None
     if miner_no_list:
         objs = MinerBase().get_miner_day_ranking_list(start_date, end_date, sector_type=sector_type,
                                                       miner_no_list=miner_no_list, filter_type="avg_reward")
     else:
-        clkey = "{0}_{1}_{2}".format(start_date, end_date, "avg_reward")
-        objs = MinerBase().get_miner_day_ranking_list_cache(clkey, start_date, end_date, filter_type="avg_reward")
-
-    data = Page(objs, page_size).page(page_index)
+        # 标准时间窗口直接读预先计算的排行榜
+        leaderboard = MinerBase().get_miner_leaderboard(start_date, end_date, sector_type=sector_type,
+                                                        filter_type="avg_reward")
+        clkey = "{0}_{1}_{2}_{3}".format(start_date, end_date, "avg_reward", sector_type)
+        objs = leaderboard if leaderboard is not None else MinerBase().get_miner_day_ranking_list_cache(
+            clkey, start_date, end_date, sector_type=sector_type, filter_type="avg_reward")
+
+    if leaderboard is not None:
+        data = MinerBase().get_miner_leaderboard_page(leaderboard, page_index, page_size, filter_type="avg_reward")
+    else:
+        data = Page(objs, page_size).page(page_index)
     miner_list = MinerBase().get_miner_list(miner_no_list=[miner_day[0] for miner_day in data['objects']]).all()
     miner_no_dict = {}
     for miner in miner_list:
@@ -220,7 +247,8 @@ def get_miner_list_by_avg_reward_for_month_avg(request):
     start_time = date - datetime.timedelta(days=30)
     end_time = date
     objs = MinerBase().get_miner_day_records(big_miner=big_miner, start_date=start_time, end_date=end_time)
-    result_data = MinerBase().get_miner_day_records_for_month_avg_value(str(date.date()), order='avg_reward',
+    clkey = "{0}_{1}".format(date.date(), big_miner)
+    result_data = MinerBase().get_miner_day_records_for_month_avg_value(clkey, str(date.date()), order='avg_reward',
                                                                         data_queryset=objs)
     data = Page(result_data, page_size).page(page_index)
     result_list = []
@@ -261,17 +289,24 @@ def get_miner_list_by_block(request):
     page_index = int(request.POST.get('page_index', 1))
     page_size = min(int(request.POST.get('page_size', 10)), 100)
     stats_type = request.POST.get('stats_type', 1)
+    leaderboard = None
     if stats_type == "24h":
         objs = MinerBase().get_miner_24h_ranking_list(order='-block_count')
         total_block_reward = MinerBase().get_miner_24h_total_block_reward()
     else:
         end_date = datetime.date.today() - datetime.timedelta(days=1)
         start_date = end_date - datetime.timedelta(days=int(stats_type[0:stats_type.find("d")]))
+        # 标准时间窗口直接读预先计算的排行榜
+        leaderboard = MinerBase().get_miner_leaderboard(start_date, end_date, filter_type="block")
         clkey = "{0}_{1}_{2}".format(start_date, end_date,"block")
-        objs = MinerBase().get_miner_day_ranking_list_cache( clkey,start_date, end_date, filter_type="block")
+        objs = leaderboard if leaderboard is not None else MinerBase().get_miner_day_ranking_list_cache(
+            clkey, start_date, end_date, filter_type="block")
         clkey = "{0}_{1}".format(start_date, end_date)
         total_block_reward = MinerBase().get_miner_day_total_block_reward(clkey,start_date, end_date)
-    data = Page(objs, page_size).page(page_index)
+    if leaderboard is not None:
+        data = MinerBase().get_miner_leaderboard_page(leaderboard, page_index, page_size, filter_type="block")
+    else:
+        data = Page(objs, page_size).page(page_index)
     miner_no_list = [miner_day[0] if type(miner_day) == tuple else miner_day.miner.miner_no for miner_day in data['objects']]
     miner_list = MinerBase().get_miner_list(miner_no_list=miner_no_list).all()
     miner_no_dict = {}
@@ -309,6 +344,16 @@ def get_miner_day_records(request):
             date = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
 
     objs = MinerBase().get_miner_day_records(date=date, start_date=start_date, end_date=end_date, miner_no=miner_no)
+    # 传cursor时使用游标分页，第一页传空字符串
+    cursor = request.POST.get('cursor')
+    if cursor is not None:
+        data = cursor_page(objs, page_size, cursor=cursor, keys=('date', 'id'))
+        if data is None:
+            return format_return(99904, data={})
+        return format_return(0, data={
+            'objs': format_miner_day(data['objects']), 'next_cursor': data['next_cursor'],
+            'has_next': data['has_next'], 'total_page': data['total_page'], 'total_count': data['total_count']
+        })
     data = Page(objs, page_size).page(page_index)
 
     return format_return(0, data={
@@ -341,10 +386,11 @@ def get_miner_mining_stats_by_no(request):
 
 @common_ajax_response
 def get_miner_line_chart_by_no(request):
-    '''矿工的算力变化和出块统计24/30/180'''
+    '''矿工的算力变化和出块统计24h/30d/90d/180d/365d'''
     miner_no = request.POST.get('miner_no')
     stats_type = request.POST.get('stats_type')
-    return format_return(0, data=MinerBase().get_miner_line_chart_by_no(miner_no, stats_type))
+    bucket = int(request.POST.get('bucket') or 0)  # 每个点合并的天数，默认按30个点划分
+    return format_return(0, data=MinerBase().get_miner_line_chart_by_no(miner_no, stats_type, bucket=bucket))
 
 
 @common_ajax_response
@@ -437,7 +483,8 @@ def sync_miner_total_stat(request):
     '''
     同步矿工状态
     '''
-    return MinerBase().sync_miner_total_stat()
+    full = json.loads(request.POST.get('full', '0'))
+    return JobBase().enqueue('sync_miner_total_stat', params={'full': full})
 
 
 # @common_ajax_response
@@ -450,9 +497,21 @@ def sync_miner_total_stat(request):
 
 @common_ajax_response
 def sync_active_miners(request):
-    MinerBase().sync_active_miners()
-    MinerBase().sync_miner_temp_stat()
-    return format_return(0)
+    '''force为1时不检查本次同步是否完整，直接删除没有同步到的矿工'''
+    force = json.loads(request.POST.get('force', '0'))
+    return JobBase().enqueue('sync_active_miners', params={'force': True} if force else None)
+
+
+@common_ajax_response
+def rebuild_miner_address(request):
+    '''全量重建地址反查索引'''
+    return JobBase().enqueue('rebuild_miner_address')
+
+
+@common_ajax_response
+def sync_miner_join_time(request):
+    '''回填矿工加入时间'''
+    return JobBase().enqueue('sync_miner_join_time')
 
 
 # @common_ajax_response
@@ -463,13 +522,38 @@ def sync_active_miners(request):
 @common_ajax_response
 def sync_miner_history(request):
     date = request.POST.get('date')
-    return MinerBase().sync_miner_history(date=date)
+    return JobBase().enqueue('sync_miner_history', params={'date': date})
+
+
+@common_ajax_response
+def sync_miner_leaderboard(request):
+    '''计算多日排行榜'''
+    date = request.POST.get('date')
+    return JobBase().enqueue('sync_miner_leaderboard', params={'date': date})
 
 
 @common_ajax_response
 def sync_miner_day_gas(request):
     date = request.POST.get('date')
-    return MinerBase().sync_miner_day_gas(date=date)
+    sharded = json.loads(request.POST.get('sharded', '0'))
+    params = {'date': date, 'sharded': sharded}
+    # 分片同步默认续跑未完成的分片，reset为1时清空当天汽油费重新同步
+    if json.loads(request.POST.get('reset', '0')):
+        params['reset'] = True
+    return JobBase().enqueue('sync_miner_day_gas', params=params)
+
+
+@common_ajax_response
+def check_miner_day_cum(request):
+    '''
+    检查矿工历史累计列
+    miner_nos为空时全量检查，全量检查通过或修复后累计列才会用于查询；repair为1时写回不一致的记录
+    '''
+    params = {'repair': bool(json.loads(request.POST.get('repair', '0')))}
+    miner_nos = request.POST.get('miner_nos')
+    if miner_nos:
+        params['miner_nos'] = miner_nos
+    return JobBase().enqueue('check_miner_day_cum', params=params)
 
 
 @common_ajax_response
@@ -477,13 +561,12 @@ def sync_miner_day_overtime_pledge_fee(request):
     date = request.POST.get('date')
     if not date:
         date = str((datetime.datetime.now() - datetime.timedelta(days=1)).date())
-    return MinerBase().sync_miner_day_overtime_pledge_fee(date=date)
+    return JobBase().enqueue('sync_miner_day_overtime_pledge_fee', params={'date': date})
 
 
 @common_ajax_response
 def sync_miner_lotus(request):
-    MinerBase().sync_miner_lotus()
-    return format_return(0)
+    return JobBase().enqueue('sync_miner_lotus')
 
 
 @common_ajax_response
@@ -529,7 +612,7 @@ def get_miner_health_report_day_by_no(request):
     if stat_type == "7d":
         end_date = datetime.datetime.today()
         start_date = end_date - datetime.timedelta(days=7)
-    objs = MinerBase().get_miner_day_records(start_date=start_date, end_date=end_date, miner_no=miner_no).all()
+    objs = MinerBase().get_miner_day_rows(miner_no, start_date=start_date, end_date=end_date)
 
     for obj in objs:
         result.append(dict(
@@ -575,7 +658,7 @@ def get_wallet_address_estimated_service_day(request):
     miner = MinerBase().get_miner_by_no(miner_no)
     end_date = datetime.datetime.today()
     start_date = end_date - datetime.timedelta(days=7)
-    miner_objs = MinerBase().get_miner_day_records(start_date=start_date, end_date=end_date, miner_no=miner_no).all()
+    miner_objs = MinerBase().get_miner_day_rows(miner_no, start_date=start_date, end_date=end_date)
     increase_power_list = []  # 7天封装量
     create_gas_list = []  # 7天节点单体gas费
     win_gas_list = []  # 7天封装量
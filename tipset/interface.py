@@ -8,7 +8,7 @@ import datetime
 from lxml import etree
 
 from django.db import transaction
-from django.db.models import Avg, Q, F, Sum, Count
+from django.db.models import Avg, Q, F, Sum, Count, Max
 
 from explorer_s_common import debug, consts, cache, raw_sql
 from explorer_s_common.utils import format_return, Validator, format_power, format_price, format_fil, \
@@ -18,7 +18,8 @@ from explorer_s_common.third.filfox_sdk import FilfoxBase
 from explorer_s_common.third.bbhe_sdk import BbheBase, BbheEsBase
 
 from explorer_s_data.consts import ERROR_DICT
-from tipset.models import Tipset, TipsetBlock, TempTipsetBlock
+from miner.models import Miner
+from tipset.models import Tipset, TipsetBlock, TempTipsetBlock, TempTipsetHourStat
 
 
 class TipsetBase(object):
@@ -42,6 +43,7 @@ class TipsetBase(object):
                 block, c = TipsetBlock.objects.get_or_create(
                     block_hash=per['block_hash'], record_time=tipset.record_time
                 )
+                old_block = None if c else (block.miner_no, _d(block.reward), block.win_count)
                 block.tipset = tipset
                 block.miner_no = per['miner_no']
                 block.msg_count = per['msg_count']
@@ -50,6 +52,10 @@ class TipsetBase(object):
                 block.penalty = _d(per['penalty']) if len(per['penalty']) <= 40 else _d(0)
                 block.height = height
                 block.save()
+                # 已有区块的奖励被修正时，同步修正矿工累计统计
+                if old_block and old_block != (block.miner_no, block.reward, block.win_count):
+                    self._adjust_miner_total_stat(block.id, old_block[0], -old_block[1], -old_block[2], -1)
+                    self._adjust_miner_total_stat(block.id, block.miner_no, block.reward, block.win_count, 1)
 
                 total_win_count += per['win_count']
                 total_block_count += 1
@@ -117,6 +123,8 @@ class TipsetBase(object):
         if not result:
             return format_return(0)
 
+        # 本页区块按(矿工, 小时)汇总的增量
+        hour_stat_dict = {}
         for tipset in result.get('data', []):
             height = tipset['height']
             record_time = self.launch_date + datetime.timedelta(seconds=30 * height)
@@ -128,6 +136,15 @@ class TipsetBase(object):
                 block, c = TempTipsetBlock.objects.get_or_create(
                     block_hash=per['block_hash'], record_time=record_time
                 )
+                # 已经同步过的区块先减去原来的值
+                hour = record_time.replace(minute=0, second=0, microsecond=0)
+                if not c and block.miner_no:
+                    stat = hour_stat_dict.setdefault((block.miner_no, hour), [_d(0), 0])
+                    stat[0] -= _d(block.reward)
+                    stat[1] -= 1
+                stat = hour_stat_dict.setdefault((per['miner_no'], hour), [_d(0), 0])
+                stat[0] += _d(per['reward'])
+                stat[1] += 1
                 block.miner_no = per['miner_no']
                 block.msg_count = per['msg_count']
                 block.win_count = per['win_count']
@@ -138,12 +155,54 @@ class TipsetBase(object):
             # 往总表同步
             self.add_tipset(height=height, blocks=tipset.get('blocks', []))
 
+        self.add_temp_tipset_hour_stat(hour_stat_dict)
+
         # 清除3天以前的数据
         yesterday = datetime.datetime.now() - datetime.timedelta(days=3)
         TempTipsetBlock.objects.filter(record_time__lt=yesterday).delete()
+        TempTipsetHourStat.objects.filter(hour__lt=yesterday.replace(minute=0, second=0, microsecond=0)).delete()
 
         return format_return(0)
 
+    def add_temp_tipset_hour_stat(self, hour_stat_dict):
+        '''
+        累加小时汇总
+        hour_stat_dict: {(矿工, 小时): [奖励增量, 区块数增量]}
+        '''
+        for (miner_no, hour), (reward, block_count) in hour_stat_dict.items():
+            if not reward and not block_count:
+                continue
+            stat, created = TempTipsetHourStat.objects.get_or_create(
+                miner_no=miner_no, hour=hour, defaults={'reward': reward, 'block_count': block_count})
+            if not created:
+                TempTipsetHourStat.objects.filter(id=stat.id).update(
+                    reward=F('reward') + reward, block_count=F('block_count') + block_count,
+                    update_time=datetime.datetime.now())
+
+    def rebuild_temp_tipset_hour_stat(self):
+        '''
+        根据临时区块重建小时汇总，用于修复增量维护出现的偏差
+        '''
+        hour_stat_dict = {}
+        for miner_no, record_time, reward in TempTipsetBlock.objects.filter().values_list(
+                'miner_no', 'record_time', 'reward').order_by():
+            key = (miner_no, record_time.replace(minute=0, second=0, microsecond=0))
+            stat = hour_stat_dict.setdefault(key, [_d(0), 0])
+            stat[0] += reward
+            stat[1] += 1
+
+        with transaction.atomic():
+            TempTipsetHourStat.objects.filter().delete()
+            TempTipsetHourStat.objects.bulk_create([
+                TempTipsetHourStat(miner_no=miner_no, hour=hour, reward=reward, block_count=block_count)
+                for (miner_no, hour), (reward, block_count) in hour_stat_dict.items()
+            ], batch_size=1000)
+        return format_return(0, data=len(hour_stat_dict))
+
+    def get_miner_hour_stats(self, miner_no, start_time):
+        '''矿工start_time之后每小时的出块奖励和出块数'''
+        return TempTipsetHourStat.objects.filter(miner_no=miner_no, hour__gte=start_time).order_by('hour')
+
     def get_tipsets(self, height=None):
         objs = Tipset.objects.all()
         if height is not None:
@@ -230,24 +289,61 @@ class TipsetBase(object):
 
     def get_date_tipset_stat(self, start_date=None, end_date=None, miner_no=None):
         '''获取指定日期的区块统计信息'''
-        conditions = ''
-        if start_date and miner_no:
-            conditions = (" WHERE '%s' <= record_time AND record_time < '%s' AND miner_no = '%s' " % (
-                start_date, end_date, miner_no))
-        else:
-            if start_date:
-                conditions = (" WHERE '%s' <= record_time AND record_time < '%s' " % (start_date, end_date))
-            if miner_no:
-                conditions = (" WHERE miner_no = '%s' " % (miner_no))
+        conditions = []
+        params = []
+        if start_date:
+            conditions.append('%s <= record_time AND record_time < %s')
+            params.extend([start_date, end_date])
+        if miner_no:
+            conditions.append('miner_no = %s')
+            params.append(miner_no)
 
         sql = """
             SELECT miner_no, SUM(reward), SUM(win_count), COUNT(miner_no) 
             FROM tipset_tipsetblock 
-        """ + conditions + """
+        """ + ((' WHERE ' + ' AND '.join(conditions)) if conditions else '') + """
+            GROUP BY miner_no
+        """
+
+        return raw_sql.exec_sql(sql, params)
+
+    def get_block_tipset_stat(self, start_id=None, end_id=None, miner_nos=None):
+        '''获取区块id区间(start_id, end_id]的区块统计信息'''
+        conditions = []
+        params = []
+        if start_id is not None:
+            conditions.append('id > %s')
+            params.append(start_id)
+        if end_id is not None:
+            conditions.append('id <= %s')
+            params.append(end_id)
+        if miner_nos:
+            conditions.append('miner_no IN (%s)' % ', '.join(['%s'] * len(miner_nos)))
+            params.extend(miner_nos)
+
+        sql = """
+            SELECT miner_no, SUM(reward), SUM(win_count), COUNT(miner_no) 
+            FROM tipset_tipsetblock 
+        """ + ((' WHERE ' + ' AND '.join(conditions)) if conditions else '') + """
             GROUP BY miner_no
         """
+        return raw_sql.exec_sql(sql, params)
 
-        return raw_sql.exec_sql(sql)
+    def get_max_block_id(self, settle_seconds=600):
+        '''
+        获取已写入区块的最大id，作为累计统计的水位
+        只取settle_seconds之前写入的区块，避免还未提交的事务中id更小的区块被跳过
+        '''
+        settle_time = datetime.datetime.now() - datetime.timedelta(seconds=settle_seconds)
+        return TipsetBlock.objects.filter(create_time__lte=settle_time).aggregate(Max('id'))['id__max'] or 0
+
+    def _adjust_miner_total_stat(self, block_id, miner_no, reward, win_count, block_count):
+        '''已经计入矿工累计统计(水位不低于block_id)的区块被修改时，直接修正累计值'''
+        if not miner_no:
+            return
+        Miner.objects.filter(miner_no=miner_no, total_stat_block_id__gte=block_id).update(
+            total_reward=F('total_reward') + reward, total_win_count=F('total_win_count') + win_count,
+            total_block_count=F('total_block_count') + block_count)
 
     def get_temp_tipset_sum_reward(self):
         '''获取24小时临时奖励总和'''
@@ -53,3 +53,20 @@ class TempTipsetBlock(models.Model):
 
     class Meta:
         ordering = ["-record_time", "-create_time", ]
+
+
+class TempTipsetHourStat(models.Model):
+    '''
+    临时区块按矿工、小时汇总，由同步临时区块时增量维护
+    '''
+    miner_no = models.CharField('矿工id', max_length=128)
+    hour = models.DateTimeField('小时', db_index=True)
+    reward = models.DecimalField('区块奖励', max_digits=40, decimal_places=0, default=0)
+    block_count = models.IntegerField('区块数量', default=0)
+
+    create_time = models.DateTimeField('创建时间', auto_now_add=True)
+    update_time = models.DateTimeField('修改时间', auto_now=True)
+
+    class Meta:
+        ordering = ["-hour", ]
+        unique_together = ("miner_no", "hour")
@@ -13,4 +13,5 @@ urlpatterns = [
 
     url(r'^sync_tipset$', views.sync_tipset),
     url(r'^sync_temp_tipset$', views.sync_temp_tipset),
+    url(r'^rebuild_temp_tipset_hour_stat$', views.rebuild_temp_tipset_hour_stat),  # 重建临时区块小时汇总
 ]
@@ -15,8 +15,10 @@ from explorer_s_common.third.filscout_sdk import FilscoutBase
 from explorer_s_common.third.filfox_sdk import FilfoxBase
 
 from explorer_s_data import consts
+from explorer_s_data.utils import cursor_page
 from tipset.interface import TipsetBase
 from message.interface import MessageBase
+from job.interface import JobBase
 
 
 def format_block(objs):
@@ -61,6 +63,16 @@ def get_tipsets(request):
     page_size = min(int(request.POST.get('page_size', 10)), 50)
 
     objs = TipsetBase().get_tipsets(height=height)
+    # 传cursor时使用游标分页，第一页传空字符串
+    cursor = request.POST.get('cursor')
+    if cursor is not None:
+        data = cursor_page(objs, page_size, cursor=cursor, keys=('height', 'id'))
+        if data is None:
+            return format_return(99904, data={})
+        return format_return(0, data={
+            'objs': format_tipset(data['objects']), 'next_cursor': data['next_cursor'],
+            'has_next': data['has_next'], 'total_page': data['total_page'], 'total_count': data['total_count']
+        })
     data = Page(objs, page_size).page(page_index)
 
     return format_return(0, data={
@@ -126,6 +138,16 @@ def get_miner_blocks(request):
     start_time = request.POST.get('start_time')
     end_time = request.POST.get('end_time')
     objs = TipsetBase().get_miner_blocks(miner_no=miner_no, start_time=start_time, end_time=end_time)
+    # 传cursor时使用游标分页，第一页传空字符串
+    cursor = request.POST.get('cursor')
+    if cursor is not None:
+        data = cursor_page(objs, page_size, cursor=cursor, keys=('record_time', 'id'))
+        if data is None:
+            return format_return(99904, data={})
+        return format_return(0, data={
+            'objs': format_block(data['objects']), 'next_cursor': data['next_cursor'],
+            'has_next': data['has_next'], 'total_page': data['total_page'], 'total_count': data['total_count']
+        })
     data = Page(objs, page_size).page(page_index)
 
     return format_return(0, data={
@@ -153,11 +175,15 @@ def get_block_count(request):
 @common_ajax_response
 def sync_tipset(request):
     date = request.POST.get('date')
-    return TipsetBase().sync_tipset(date=date)
+    return JobBase().enqueue('sync_tipset', params={'date': date})
 
 
 @common_ajax_response
 def sync_temp_tipset(request):
-    TipsetBase().sync_temp_tipset()
-    TipsetBase().sync_tipset_warning()
-    return format_return(0)
+    return JobBase().enqueue('sync_temp_tipset')
+
+
+@common_ajax_response
+def rebuild_temp_tipset_hour_stat(request):
+    '''根据临时区块重建小时汇总，部署后回填或修复偏差时使用'''
+    return JobBase().enqueue('rebuild_temp_tipset_hour_stat')
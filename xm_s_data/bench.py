@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import hashlib
+import importlib
+import threading
+import contextlib
+
+from django.db import connection
+
+# 需要录制/回放的第三方sdk
+BENCH_SDK_CLASSES = [
+    ('explorer_s_common.third.bbhe_sdk', 'BbheBase'),
+    ('explorer_s_common.third.bbhe_sdk', 'BbheEsBase'),
+    ('explorer_s_common.third.filfox_sdk', 'FilfoxBase'),
+    ('explorer_s_common.third.fam_sdk', 'FamBase'),
+]
+
+
+def _sdk_methods():
+    '''返回[(类, 方法名)]，只处理类上定义的公开方法'''
+    result = []
+    for module_name, class_name in BENCH_SDK_CLASSES:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        for name, value in vars(cls).items():
+            if not name.startswith('_') and callable(value):
+                result.append((cls, name))
+    return result
+
+
+def _call_key(args, kwargs):
+    '''调用参数的唯一标识，不包含self'''
+    raw = json.dumps({'args': args, 'kwargs': kwargs}, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class SdkFixtures(object):
+    '''
+    sdk响应的fixture文件
+    每个方法一个文件: {fixture_dir}/{类名}.{方法名}.json，内容为{调用标识: 响应}
+    '''
+
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def _path(self, cls, name):
+        return os.path.join(self.fixture_dir, '%s.%s.json' % (cls.__name__, name))
+
+    def load(self, cls, name):
+        key = (cls.__name__, name)
+        if key not in self.data:
+            path = self._path(cls, name)
+            self.data[key] = json.load(open(path)) if os.path.exists(path) else {}
+        return self.data[key]
+
+    def get(self, cls, name, args, kwargs):
+        responses = self.load(cls, name)
+        call_key = _call_key(args, kwargs)
+        if call_key not in responses:
+            raise KeyError('没有录制的响应: %s.%s args=%s kwargs=%s' % (cls.__name__, name, args, kwargs))
+        return responses[call_key]
+
+    def put(self, cls, name, args, kwargs, response):
+        with self.lock:
+            self.load(cls, name)[_call_key(args, kwargs)] = response
+
+    def save(self):
+        if not os.path.exists(self.fixture_dir):
+            os.makedirs(self.fixture_dir)
+        for (class_name, name), responses in self.data.items():
+            if not responses:
+                continue
+            path = os.path.join(self.fixture_dir, '%s.%s.json' % (class_name, name))
+            with open(path, 'w') as f:
+                json.dump(responses, f, sort_keys=True, default=str)
+
+
+@contextlib.contextmanager
+def _patch_sdk(make_method):
+    '''替换sdk类上的公开方法，退出时还原'''
+    originals = []
+    for cls, name in _sdk_methods():
+        original = vars(cls)[name]
+        originals.append((cls, name, original))
+        setattr(cls, name, make_method(cls, name, original))
+    try:
+        yield
+    finally:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+
+
+@contextlib.contextmanager
+def record_sdk(fixture_dir):
+    '''调用真实接口，同时把响应录制到fixture_dir'''
+    fixtures = SdkFixtures(fixture_dir)
+
+    def make_method(cls, name, original):
+        def method(self, *args, **kwargs):
+            response = original(self, *args, **kwargs)
+            fixtures.put(cls, name, args, kwargs, response)
+            return response
+        return method
+
+    try:
+        with _patch_sdk(make_method):
+            yield fixtures
+    finally:
+        fixtures.save()
+
+
+@contextlib.contextmanager
+def replay_sdk(fixture_dir, latency=0):
+    '''
+    不访问网络，从fixture_dir返回录制的响应
+    latency: 每次调用模拟的网络延迟(秒)
+    没有录制过的调用直接抛出KeyError
+    '''
+    fixtures = SdkFixtures(fixture_dir)
+
+    def make_method(cls, name, original):
+        def method(self, *args, **kwargs):
+            if latency:
+                time.sleep(latency)
+            return json.loads(json.dumps(fixtures.get(cls, name, args, kwargs)))
+        return method
+
+    with _patch_sdk(make_method):
+        yield fixtures
+
+
+class QueryCounter(object):
+    '''
+    统计当前线程数据库连接上的查询数与写入行数
+    后台线程、子进程中的查询不计入
+    '''
+
+    def __init__(self):
+        self.query_count = 0
+        self.write_count = 0
+        self.write_rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.query_count += 1
+        if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self.write_count += 1
+            self.write_rows += max(context['cursor'].rowcount, 0)
+        return result
+
+
+def bench_call(func, *args, **kwargs):
+    '''
+    执行一次同步方法，返回耗时、查询数与写入行数
+    '''
+    counter = QueryCounter()
+    _time_start = time.time()
+    with connection.execute_wrapper(counter):
+        func(*args, **kwargs)
+    _time_cost = time.time() - _time_start
+    return {
+        'time_cost': _time_cost,
+        'query_count': counter.query_count,
+        'write_count': counter.write_count,
+        'write_rows': counter.write_rows,
+        'rows_per_second': int(counter.write_rows / _time_cost) if _time_cost else counter.write_rows,
+    }
@@ -15,6 +15,7 @@ INSTALLED_APPS = [
     "tipset",
     "rmd",
     "deal",
+    "job",
 ]
 
 MIDDLEWARE = [
@@ -47,5 +48,9 @@ USE_I18N = True
 USE_L10N = True
 USE_TZ = False
 STATIC_URL = '/static/'
+# 矿工历史列式缓存目录
+MINER_DAY_COLUMN_DIR = os.getenv("MINER_DAY_COLUMN_DIR", os.path.join(BASE_DIR, 'data', 'miner_day_columns'))
+# 矿工历史累计列是否可用于区间合计，上线后先执行check_miner_day_cum任务(repair=true)补齐历史再打开
+MINER_DAY_CUM_ENABLED = os.getenv("MINER_DAY_CUM_ENABLED", "0") == "1"
 logging.basicConfig(format='%(levelname)s:%(asctime)s %(pathname)s--%(funcName)s--line %(lineno)d-----%(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S', level=logging.WARNING)
@@ -14,5 +14,7 @@ urlpatterns = [
 
     url(r'^data/api/fil/', include('fil.urls')),
 
+    url(r'^data/api/job/', include('job.urls')),
+
     url(r'^data/openapi/v1/', include('openapi.urls')),
 ]
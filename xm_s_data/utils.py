@@ -0,0 +1,216 @@
+import json
+import math
+import time
+import queue
+import base64
+import threading
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class _PrefetchError(object):
+    '''后台线程中的异常，交给消费方重新抛出'''
+
+    def __init__(self, error):
+        self.error = error
+
+
+_PREFETCH_END = object()
+
+
+def prefetch_pages(fetch_page, depth=2, start_index=0, stop=None):
+    '''
+    后台预取分页数据
+    fetch_page: 根据页码获取一页数据的函数
+    depth: 缓冲区最多预取的页数
+    stop: 判断一页数据是否结束的函数，默认遇到第一个空页停止
+    在gevent worker下线程会被patch成greenlet，网络等待与数据库写入可以重叠
+    '''
+    stop = stop or (lambda page: not page)
+    buffer = queue.Queue(maxsize=max(depth, 1))
+    closed = threading.Event()
+
+    def _put(item):
+        # 消费方提前退出时不再阻塞
+        while not closed.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _producer():
+        page_index = start_index
+        try:
+            while not closed.is_set():
+                page = fetch_page(page_index)
+                if stop(page):
+                    break
+                if not _put(page):
+                    return
+                page_index += 1
+        except Exception as e:
+            _put(_PrefetchError(e))
+            return
+        _put(_PREFETCH_END)
+
+    worker = threading.Thread(target=_producer, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _PREFETCH_END:
+                break
+            if isinstance(item, _PrefetchError):
+                raise item.error
+            yield item
+    finally:
+        closed.set()
+
+
+class TokenBucket(object):
+    '''
+    令牌桶限流
+    rate: 每秒补充的令牌数
+    capacity: 桶容量，允许的瞬时突发请求数
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''获取一个令牌，不足时等待'''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+                self.last_time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# 汽油费统计需要的消息字段
+GAS_MESSAGE_FIELDS = [
+    'height', 'msg_cid', 'msg_to', 'msg_method', 'msg_method_name', 'msg_value', 'msg_params', 'msgrct_exit_code',
+    'base_fee2', 'sector_size', 'sector_count', 'msg_gas_limit', 'msg_gas_fee_cap', 'msg_gas_premium',
+    'gascost_total_cost', 'gascost_gas_used', 'gascost_base_fee_burn'
+]
+
+
+def _pick_fields(hits, fields):
+    if not fields:
+        return hits
+    return [{'_source': dict([(k, x['_source'][k]) for k in fields if k in x['_source']])} for x in hits]
+
+
+def scroll_messages(label, page_size=500, **kwargs):
+    '''
+    get_message_list取第一页，之后按_scroll_id滚动，每次返回一页原始hits
+    kwargs为get_message_list的过滤条件，取到的条数与es返回的总数不一致时抛出ValueError，避免静默丢消息
+    '''
+    from explorer_s_common.third.bbhe_sdk import BbheEsBase
+
+    result = BbheEsBase().get_message_list(page_index=1, page_size=page_size, **kwargs)
+    total = (result or {}).get('total', {}).get('value', 0)
+    count = 0
+    while result and result.get('hits'):
+        count += len(result['hits'])
+        yield result['hits']
+        if count >= total or not result.get('_scroll_id'):
+            break
+        result = BbheEsBase().scroll(result['_scroll_id'])
+    if count != total:
+        raise ValueError('%s的消息不完整: %s/%s' % (label, count, total))
+
+
+def iter_height_messages(start_height, end_height, batch_size=120, page_size=500, prefetch=2,
+                         fields=GAS_MESSAGE_FIELDS):
+    '''
+    流式获取高度区间[start_height, end_height)的消息
+    每batch_size个高度为一批，批内用get_message_list加scroll每次取page_size条，后台预取prefetch批
+    返回(批次开始高度, 批次结束高度, hits)，hits中的_source只保留fields字段
+    '''
+    batch_count = int(math.ceil(max(end_height - start_height, 0) / batch_size))
+
+    def _fetch(batch_index):
+        if batch_index >= batch_count:
+            return None
+        batch_start = start_height + batch_index * batch_size
+        batch_end = min(batch_start + batch_size, end_height)
+        hits = []
+        for page in scroll_messages('高度%s-%s' % (batch_start, batch_end), page_size=page_size, all=True,
+                                    start_height=batch_start, end_height=batch_end):
+            # 批次之间不重叠，结束高度上的消息留给下一批
+            hits.extend(_pick_fields(
+                [x for x in page if batch_start <= int(x['_source']['height']) < batch_end], fields))
+        return batch_start, batch_end, hits
+
+    return prefetch_pages(_fetch, depth=prefetch, stop=lambda page: page is None)
+
+
+def iter_method_messages(msg_method, start_height, end_height, page_size=500, fields=GAS_MESSAGE_FIELDS):
+    '''按消息方法滚动获取高度区间内的消息，每次返回一页hits'''
+    for page in scroll_messages('方法%s高度%s-%s' % (msg_method, start_height, end_height), page_size=page_size,
+                                msg_method=msg_method, start_height=start_height, end_height=end_height):
+        yield _pick_fields(page, fields)
+
+
+def encode_cursor(values):
+    '''把排序键的值编码成不透明的游标'''
+    raw = json.dumps([str(x) for x in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor, count=None):
+    '''解码游标，格式不对(包括base64、json错误和值的个数不对)时抛出ValueError'''
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8'))
+    if not isinstance(values, list) or (count is not None and len(values) != count):
+        raise ValueError('游标格式错误')
+    return values
+
+
+def cursor_page(objs, page_size, cursor=None, keys=('id',)):
+    '''
+    游标分页，按keys倒序，用WHERE定位代替OFFSET
+    keys最后一个字段需要唯一(一般是id)，第一个字段需要有索引
+    只有第一页(cursor为空)统计总数，后续页total_count、total_page返回None
+    cursor不合法时返回None，由调用方返回参数错误
+    '''
+    objs = objs.order_by(*['-%s' % x for x in keys])
+    total_count = total_page = None
+    if cursor:
+        try:
+            values = decode_cursor(cursor, count=len(keys))
+            # 按字段类型校验，避免非法值在查询时报错
+            values = [objs.model._meta.get_field(k).to_python(v) for k, v in zip(keys, values)]
+        except (ValueError, ValidationError):
+            return None
+        # (k1, k2, ...) < (v1, v2, ...)
+        condition = Q()
+        for i in range(len(keys)):
+            per = Q(**{'%s__lt' % keys[i]: values[i]})
+            for j in range(i):
+                per &= Q(**{keys[j]: values[j]})
+            condition |= per
+        objs = objs.filter(condition)
+    else:
+        total_count = objs.count()
+        total_page = int(math.ceil(total_count / page_size)) if page_size else 0
+
+    objects = list(objs[:page_size + 1])
+    has_next = len(objects) > page_size
+    objects = objects[:page_size]
+    next_cursor = encode_cursor([getattr(objects[-1], x) for x in keys]) if has_next else None
+    return {
+        'objects': objects, 'next_cursor': next_cursor, 'has_next': has_next,
+        'total_count': total_count, 'total_page': total_page
+    }